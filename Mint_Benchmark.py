@@ -0,0 +1,345 @@
+from datetime import datetime, timedelta
+import subprocess
+import argparse
+import tempfile
+import platform
+import random
+import json
+import time
+import sys
+import os
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+mint_parser_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Mint_Parser.py")
+mint_header = ["Date", "Description", "Original Description", "Amount", "Transaction Type", "Category",
+               "Account Name", "Labels", "Notes"]
+mint_categories = ["Groceries", "Gas & Fuel", "Restaurants", "Shopping", "Utilities", "Income", "Transfer",
+                   "Mortgage & Rent", "Entertainment", "Health & Fitness"]
+mint_accounts = ["Checking", "Savings", "Credit Card", "Brokerage"]
+merchant_words = ["Market", "Fuel", "Cafe", "Store", "Online", "Payroll", "Pharmacy", "Electric", "Cinema", "Gym",
+                  "Books", "Hardware", "Airlines", "Hotel", "Insurance", "Bank"]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Used to measure the throughput of the Mint_Parser.py actions on '
+                                                 'synthetic Mint.com transaction exports.')
+
+    parser.add_argument(
+        '--rows',
+        nargs='+',
+        type=int,
+        default=[100000],
+        help='Number of transactions in each generated transactions file. Default is 100000.'
+    )
+    parser.add_argument(
+        '--merchants',
+        type=int,
+        default=500,
+        help='Number of distinct merchants in the generated transactions. Default is 500.'
+    )
+    parser.add_argument(
+        '--years',
+        type=int,
+        default=5,
+        help='Number of years the generated transaction dates span. Default is 5.'
+    )
+    parser.add_argument(
+        '--patterns',
+        type=int,
+        default=100,
+        help='Number of patterns in the generated pattern file. Default is 100.'
+    )
+    parser.add_argument(
+        '--action',
+        nargs='+',
+        default=["GroupByPatternFile", "GroupByColumnValue", "GroupBySearchPattern"],
+        help='Actions to benchmark. Default is every action.'
+    )
+    parser.add_argument(
+        '--date_period',
+        nargs='+',
+        default=["Real", "Daily", "Weekly", "Biweekly", "ISOWeekly", "Monthly", "FiscalQuarterly", "Yearly",
+                 "FiscalYearly"],
+        help='Date periods to benchmark. Default is every date period.'
+    )
+    parser.add_argument(
+        '--extra_args',
+        default="",
+        help='Extra arguments passed to every Mint_Parser.py run, for example "--workers 4".'
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=1,
+        help='Number of times to run each case, the fastest run is reported. Default is 1.'
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        help='Seed for the random generator so generated files are the same between runs. Default is 0.'
+    )
+    parser.add_argument(
+        '--work_directory',
+        help='Directory to write the generated files and outputs to. Default is a temporary directory.'
+    )
+    parser.add_argument(
+        '--output_file_json',
+        default="benchmark_results.json",
+        help='File to output the json results to. Default is benchmark_results.json.'
+    )
+    parser.add_argument(
+        '--baseline_file_json',
+        help='Results of an earlier benchmark run to compare rows/sec against.'
+    )
+
+    # Used internally to run a single case in a fresh process
+    parser.add_argument('--run_case', help=argparse.SUPPRESS)
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+
+    if args.run_case:
+        run_case(json.loads(args.run_case))
+        return
+
+    if args.work_directory:
+        os.makedirs(args.work_directory, exist_ok=True)
+        run_benchmark(args, args.work_directory)
+    else:
+        with tempfile.TemporaryDirectory() as work_directory:
+            run_benchmark(args, work_directory)
+
+
+def run_benchmark(args, work_directory):
+    random_generator = random.Random(args.seed)
+    merchant_list = get_merchants(random_generator, args.merchants)
+
+    # Generate the pattern file
+    pattern_file = os.path.join(work_directory, "benchmark_patterns.json")
+    start_time = time.perf_counter()
+    generate_pattern_file(random_generator, pattern_file, merchant_list, args.patterns)
+    print("Generated {} with {} patterns in {:.2f}s".format(pattern_file, args.patterns,
+                                                          time.perf_counter() - start_time))
+
+    result_list = []
+    for row_count in args.rows:
+        # Generate the transactions file
+        transactions_file = os.path.join(work_directory, "benchmark_transactions_{}.csv".format(row_count))
+        start_time = time.perf_counter()
+        generate_transactions_file(random_generator, transactions_file, merchant_list, row_count, args.years)
+        print("Generated {} with {} rows in {:.2f}s".format(transactions_file, row_count,
+                                                           time.perf_counter() - start_time))
+
+        for a in args.action:
+            for date_period in args.date_period:
+                parser_args = [
+                    "--action", a,
+                    "--transactions_file", transactions_file,
+                    "--pattern_file", pattern_file,
+                    "--search_pattern", merchant_list[0],
+                    "--date_period", date_period,
+                    "--date_range", "All",
+                    "--user_interface", "False",
+                    "--output_file_json", os.path.join(work_directory, "benchmark_output.json"),
+                    "--output_file_csv", os.path.join(work_directory, "benchmark_output.csv"),
+                ] + args.extra_args.split()
+
+                # Keep the run of the case that grouped the rows the fastest
+                best_result = None
+                for i in range(args.repeat):
+                    result = run_case_process(parser_args)
+                    if best_result is None or result["Stages"]["Group"] < best_result["Stages"]["Group"]:
+                        best_result = result
+
+                # Rows/sec only counts grouping the rows, the process startup and writing the results are left out so
+                # a change in the actions isn't hidden by them
+                group_time = best_result["Stages"]["Group"]
+                total_time = best_result["Total Time"]
+                best_result.update({
+                    "Action": a,
+                    "Date Period": date_period,
+                    "Rows": row_count,
+                    "Rows/sec": round(row_count/group_time, 1) if group_time else None,
+                    "End To End Rows/sec": round(row_count/total_time, 1) if total_time else None,
+                })
+                result_list.append(best_result)
+                print_result(best_result)
+
+    results_dict = {
+        "Date": datetime.now().isoformat(timespec="seconds"),
+        "Version": get_version(),
+        "Python": platform.python_version(),
+        "Platform": platform.platform(),
+        "Settings": {
+            "rows": args.rows,
+            "merchants": args.merchants,
+            "years": args.years,
+            "patterns": args.patterns,
+            "extra_args": args.extra_args,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "Results": result_list,
+    }
+    with open(args.output_file_json, 'w') as file_out:
+        json.dump(results_dict, file_out, indent=4)
+    print("Output results to {}".format(args.output_file_json))
+
+    if args.baseline_file_json:
+        compare_results(args.baseline_file_json, result_list)
+
+
+def run_case_process(parser_args):
+    # Run the case in a new process so the peak memory of each case is measured on its own
+    command = [sys.executable, os.path.abspath(__file__), "--run_case", json.dumps(parser_args)]
+    start_time = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate()
+    total_time = time.perf_counter() - start_time
+    if process.returncode != 0:
+        print(stderr.decode(errors="replace"))
+        raise RuntimeError("Benchmark case failed: {}".format(" ".join(parser_args)))
+
+    # The case prints its stage times as the last line
+    result = json.loads(stdout.decode().strip().splitlines()[-1])
+    result["Total Time"] = round(total_time, 4)
+    return result
+
+
+def get_peak_rss_mb():
+    # Peak resident memory of this process, ru_maxrss is in KB on Linux and bytes on macOS
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    if sys.platform == "darwin":
+        return round(usage.ru_maxrss / (1024 * 1024), 1)
+    return round(usage.ru_maxrss / 1024, 1)
+
+
+def run_case(parser_args):
+    stage_dict = {}
+
+    # Load the parser and its arguments
+    start_time = time.perf_counter()
+    sys.path.insert(0, os.path.dirname(mint_parser_file))
+    import Mint_Parser
+    sys.argv = [mint_parser_file] + parser_args
+    args = Mint_Parser.get_args()
+    stage_dict["Startup"] = time.perf_counter() - start_time
+
+    # Group the transactions
+    start_time = time.perf_counter()
+    category_dict_list = Mint_Parser.group_transactions(args, args.action)
+    stage_dict["Group"] = time.perf_counter() - start_time
+
+    # Write the results
+    stage_dict["Write Json"] = 0
+    stage_dict["Write Csv"] = 0
+    for a, category_dict in zip(args.action, category_dict_list):
+        output_file_json, output_file_csv = Mint_Parser.get_output_files(args, a, args.action)
+        start_time = time.perf_counter()
+        Mint_Parser.save_transaction_json(args, category_dict, output_file_json)
+        stage_dict["Write Json"] += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        Mint_Parser.save_transaction_csv(args, category_dict, output_file_csv)
+        stage_dict["Write Csv"] += time.perf_counter() - start_time
+
+    print(json.dumps({
+        "Stages": {key: round(value, 4) for key, value in stage_dict.items()},
+        "Peak RSS MB": get_peak_rss_mb(),
+    }))
+
+
+def get_merchants(random_generator, merchant_count):
+    merchant_list = []
+    for i in range(merchant_count):
+        merchant_list.append("{} {} #{:04d}".format(
+            random_generator.choice(merchant_words).upper(), random_generator.choice(merchant_words), i))
+    return merchant_list
+
+
+def generate_pattern_file(random_generator, pattern_file, merchant_list, pattern_count):
+    # Mostly literal patterns like the default pattern file, with some real regular expressions mixed in
+    category_dict_pattern = {}
+    for i in range(pattern_count):
+        merchant = random_generator.choice(merchant_list)
+        if i % 10 == 9:
+            pattern = "{}.*{}".format(merchant.split(" ")[0], merchant.split("#")[1])
+        else:
+            pattern = ".*{}.*".format(merchant)
+        category_dict_pattern.setdefault("CATEGORY_{}".format(i % 20), []).append(pattern)
+
+    with open(pattern_file, 'w') as file_out:
+        json.dump(category_dict_pattern, file_out, indent=4)
+
+
+def generate_transactions_file(random_generator, transactions_file, merchant_list, row_count, years):
+    # Merchants are picked with a skewed distribution since a few merchants make up most transactions
+    end_date = datetime(2021, 12, 31)
+    day_count = 365 * years
+    weight_list = [1 / (i + 1) for i in range(len(merchant_list))]
+    merchant_sample = random_generator.choices(merchant_list, weights=weight_list, k=row_count)
+
+    with open(transactions_file, 'w', newline='') as file_out:
+        file_out.write(",".join('"{}"'.format(column) for column in mint_header) + "\n")
+        for merchant in merchant_sample:
+            date_obj = end_date - timedelta(days=random_generator.randrange(day_count))
+            transaction_type = "credit" if random_generator.random() < 0.2 else "debit"
+            row = [
+                "{}/{:02d}/{}".format(date_obj.month, date_obj.day, date_obj.year),
+                merchant.title(),
+                merchant,
+                "{:.2f}".format(random_generator.lognormvariate(3, 1.2)),
+                transaction_type,
+                random_generator.choice(mint_categories),
+                random_generator.choice(mint_accounts),
+                "",
+                "",
+            ]
+            file_out.write(",".join('"{}"'.format(value) for value in row) + "\n")
+
+
+def get_version():
+    # Git commit of the parser being measured, if available
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(mint_parser_file), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result):
+    print("{:<22} {:<10} {:>10} rows {:>12} rows/sec {:>12} end to end rows/sec {:>8} MB  {}".format(
+        result["Action"], result["Date Period"], result["Rows"], result["Rows/sec"], result["End To End Rows/sec"],
+        result["Peak RSS MB"], " ".join("{}={:.3f}s".format(key, value) for key, value in result["Stages"].items())
+    ))
+
+
+def compare_results(baseline_file_json, result_list):
+    with open(baseline_file_json, 'r') as file_in:
+        baseline_dict = json.load(file_in)
+
+    baseline_result_dict = {
+        (result["Action"], result["Date Period"], result["Rows"]): result for result in baseline_dict["Results"]
+    }
+    print("Compared to {} ({})".format(baseline_file_json, baseline_dict.get("Version")))
+    for result in result_list:
+        baseline_result = baseline_result_dict.get((result["Action"], result["Date Period"], result["Rows"]))
+        if not baseline_result or not baseline_result["Rows/sec"] or not result["Rows/sec"]:
+            continue
+        change = (result["Rows/sec"] / baseline_result["Rows/sec"] - 1) * 100
+        print("{:<22} {:<10} {:>10} rows {:>+8.1f}% rows/sec".format(
+            result["Action"], result["Date Period"], result["Rows"], change))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,50 @@
 from datetime import datetime
+import functools
 import fnmatch
+import concurrent.futures
+import array
+import collections
 import calendar
+import itertools
 import argparse
+import hashlib
+import threading
+import queue
+import http.server
+import bisect
+import mmap
+import locale
+import io
 import json
-import copy
+import time
 import csv
 import re
 import os
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 date_import_format = r"%m/%d/%Y"
+read_buffer_size = 1024 * 1024
+write_buffer_size = 1024 * 1024
+date_cache_size = 65536
+batch_block_rows = 1024
+batch_queue_size = 16
+amount_regex = re.compile(r"\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?")
+transaction_store_magic = b"MINTSTORE1\n"
+date_index_magic = b"MINTINDEX1\n"
+action_choices = ["GroupByPatternFile", "GroupByColumnValue", "GroupBySearchPattern"]
+date_period_choices = ["Real", "Daily", "Biweekly", "Weekly", "ISOWeekly", "Monthly", "FiscalQuarterly", "Yearly",
+                       "FiscalYearly"]
+date_range_choices = ["All", "YTD", "Year", "CurrentMonth", "PreviousMonth", "Custom"]
+transaction_retention_choices = ["Full", "Offset", "None"]
+engine_choices = ["Rows", "Columnar"]
+output_json_style_choices = ["Indented", "Compact", "Lines"]
 
 
 def get_args():
-    action_choices = ["GroupByPatternFile", "GroupByColumnValue", "GroupBySearchPattern"]
-    date_period_choices = ["Real", "Daily", "Biweekly", "Weekly", "Monthly", "Yearly"]
-    date_range_choices = ["All", "YTD", "Year", "CurrentMonth", "PreviousMonth", "Custom"]
     transaction_file_choices = ["Enter Path"]
     valid_file_args = ["transactions_file", "pattern_file"]
     add_help = "Pass the -h argument for more information"
@@ -54,6 +84,59 @@ def get_args():
         ],
     }
 
+    parser = get_arg_parser()
+    args = parser.parse_args()
+
+    # Check that arguments are valid
+    # Make sure action was passed
+    if args.action is None:
+        msg = "--action argument must be passed. {}".format(add_help)
+        args.action = request_arg(args, msg, action_choices, True)
+        if args.action is None:
+            parser.error(msg)
+
+    # See if we are missing any arguments
+    for a in args.action:
+        for key in actions_args_dict[a]:
+            # If argument was not passed
+            if key not in vars(args).keys() or vars(args)[key] is None:
+                msg = "The argument --{} is required when passing the argument --action {}. " \
+                      "{}".format(key, ", ".join(args.action), add_help)
+                if key == "date_period":
+                    vars(args)[key] = request_arg(args, msg, date_period_choices, True)
+                elif key == "date_range":
+                    vars(args)[key] = request_arg(args, msg, date_range_choices)
+                    set_date_range(args)
+                else:
+                    vars(args)[key] = request_arg(args, msg)
+                    if key not in vars(args).keys() or vars(args)[key] is None:
+                        parser.error(msg)
+            # if argument was passed but does not point to a valid file
+            elif key in valid_file_args and not os.path.exists(vars(args)[key]) and \
+                    not (key == "transactions_file" and (args.batch or args.watch)):
+                msg = "Argument --{} does not point to a valid file ({}). {}".format(key, vars(args)[key], add_help)
+
+                # Search for transaction files
+                for transactions_file in find_transactions_files(args):
+                    transaction_file_choices.insert(0, transactions_file)
+
+                # Query user to pick one of the found files or enter their own
+                vars(args)[key] = request_arg(args, msg, transaction_file_choices)
+                if not os.path.exists(vars(args)[key]):
+                    parser.error(msg)
+
+    if args.date_period is not None:
+        args.date_period = get_date_period_tuple(args.date_period)
+
+    # The totals of each chunk are merged, and floating point sums depend on the order they are added in.  Whole cents
+    # add up the same in any order, so the output doesn't depend on the number of workers.
+    if args.workers != 1 and not args.batch and not args.watch:
+        args.amount_cents = True
+
+    return args
+
+
+def get_arg_parser():
     usage = " Mint_Parser.py [-h]\n" \
             "                       --action GroupByPatternFile --pattern_file PATTERN_FILE\n" \
             "                       --action GroupByColumnValue --categorize_column CATEGORIZE_COLUMN\n" \
@@ -83,6 +166,33 @@ def get_args():
         default=os.getcwd(),
         help='Used to search for transaction files when one was not provided.'
     )
+    parser.add_argument(
+        '--batch',
+        action='store_true',
+        help='Group every transactions file found by --transactions_file_search_pattern in '
+             '--transactions_file_search_directory into one result instead of reading --transactions_file. Rows that '
+             'show up in more than one file are only grouped once. The files are read by --workers threads.'
+    )
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Keep running and group the transactions files found like --batch whenever a file is added or grows. Only '
+             'the new rows are grouped, the --pattern_file is reloaded when it changes and the output files are '
+             'rewritten after every change. Press Ctrl+C to stop.'
+    )
+    parser.add_argument(
+        '--watch_interval',
+        type=float,
+        default=5,
+        help='Seconds between checking the transactions files and --pattern_file for changes with --watch. Default is '
+             '5.'
+    )
+    parser.add_argument(
+        '--watch_port',
+        type=int,
+        help='Port of a local http server that returns the current results while --watch is running. / lists the '
+             'actions and /ACTION returns the json results of an action.'
+    )
     parser.add_argument(
         '--categorize_column',
         default="Category",
@@ -108,6 +218,13 @@ def get_args():
         default="output.csv",
         help='File to output the csv results to.'
     )
+    parser.add_argument(
+        '--output_json_style',
+        choices=output_json_style_choices,
+        default="Indented",
+        help='How the json results are written. Indented is easy to read, Compact leaves out all whitespace and Lines '
+             'writes one json object per line for each key. Default is Indented.'
+    )
     parser.add_argument(
         '--date_format',
         default=date_import_format,
@@ -115,10 +232,21 @@ def get_args():
     )
     parser.add_argument(
         '--date_period',
+        nargs='+',
         choices=date_period_choices,
-        help='The period of summation to use on the transactions when building the report. Can be one of the '
+        help='The periods of summation to use on the transactions when building the report. Every period is added up '
+             'in the same pass over the transactions. Can be one or multiples of the '
              'following: \"{}\"'.format("\" \"".join(date_period_choices))
     )
+    parser.add_argument(
+        '--fiscal_year_start_month',
+        type=int,
+        choices=range(1, 13),
+        default=1,
+        metavar="{1..12}",
+        help='Month the fiscal year starts in, used by the FiscalQuarterly and FiscalYearly --date_period. Fiscal '
+             'years are named after the year they end in. Default is 1 which is the calendar year.'
+    )
     parser.add_argument(
         '--date_range',
         choices=date_range_choices,
@@ -134,6 +262,23 @@ def get_args():
         default="Amount",
         help='Column to extract the amount from. Must match a column name in --transactions_file'
     )
+    parser.add_argument(
+        '--signed_amounts',
+        action='store_true',
+        help='Make the amount of debit transactions negative so debits and credits cancel out in the totals. The '
+             'transaction type is read from --transaction_type_column.'
+    )
+    parser.add_argument(
+        '--transaction_type_column',
+        default="Transaction Type",
+        help='Column holding "debit" or "credit", only used with --signed_amounts. Default is Transaction Type.'
+    )
+    parser.add_argument(
+        '--amount_cents',
+        action='store_true',
+        help='Add up the amounts as whole cents instead of floating point numbers, so totals of many transactions '
+             'don\'t collect rounding errors. Amounts with more than two decimals are rounded to the cent.'
+    )
 
     # Optional arguments
     parser.add_argument(
@@ -146,6 +291,78 @@ def get_args():
         help='The end date to stop searching for transactions. Enter the date in the same format as --date_format, if '
              'nothing is passed to that argument then use {}'.format(date_import_format.replace("%", "%%"))
     )
+    parser.add_argument(
+        '--transaction_retention',
+        choices=transaction_retention_choices,
+        default="Full",
+        help='What to keep of each grouped transaction for the "Transactions" list of the json output. Full keeps the '
+             'whole line, Offset keeps the byte offset of the line in --transactions_file and None keeps nothing. '
+             'Default is Full.'
+    )
+    parser.add_argument(
+        '--category_cache_size',
+        type=int,
+        default=0,
+        help='Number of transactions to remember the --pattern_file category of, keyed by every column except '
+             '--date_column and --amount_column. Repeated merchants then skip the pattern search. Only use this if no '
+             'pattern depends on the date or amount. Default is 0 which disables the cache.'
+    )
+    parser.add_argument(
+        '--category_cache_file',
+        help='File used to save the category cache between runs. It is ignored if the --pattern_file changed.'
+    )
+    parser.add_argument(
+        '--checkpoint_file',
+        help='File used to save the grouped results between runs. When the --transactions_file has only been appended '
+             'to since the last run, only the new rows are grouped and merged into the saved results. The checkpoint '
+             'is ignored if the start of the --transactions_file, the --pattern_file or any of the grouping arguments '
+             'changed.'
+    )
+    parser.add_argument(
+        '--transactions_store_file',
+        help='File used to store the --transactions_file already split into columns. It is built on the first run '
+             'and rebuilt whenever the --transactions_file changes, later runs read the rows from it instead of '
+             'parsing the csv again.'
+    )
+    parser.add_argument(
+        '--date_index_file',
+        help='File used to save an index of the transactions sorted by date. It is built on the first run with a '
+             '--date_range other than All and rebuilt whenever the --transactions_file or --date_column changes. Only '
+             'the rows inside of the date range are read.'
+    )
+    parser.add_argument(
+        '--read_ahead',
+        type=int,
+        default=0,
+        help='Number of blocks of the --transactions_file a background thread reads ahead of the rows being grouped, '
+             'so waiting on slow or network storage overlaps with grouping. Each block is 1 MB. Default is 0 which '
+             'reads the file as the rows are grouped.'
+    )
+    parser.add_argument(
+        '--engine',
+        choices=engine_choices,
+        default="Rows",
+        help='How the grouped transactions are added up. Rows adds each transaction as it is read, Columnar collects '
+             'the dates, amounts and keys into arrays and adds them up with numpy, which is faster on large '
+             'transaction files. Columnar requires numpy to be installed. Default is Rows.'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of processes used to group the transactions. The transactions file is split into one chunk per '
+             'process. More than one process implies --amount_cents. Pass 0 to use every CPU core. Default is 1.'
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help='Time each stage of grouping the transactions and every pattern in the --pattern_file, then print a '
+             'summary at the end of the run.'
+    )
+    parser.add_argument(
+        '--profile_output',
+        help='File to output the json profile results to when --profile is passed.'
+    )
     parser.add_argument(
         "--user_interface",
         type=str2bool,
@@ -156,47 +373,46 @@ def get_args():
              'being thrown.'
     )
 
-    args = parser.parse_args()
-
-    # Check that arguments are valid
-    # Make sure action was passed
-    if args.action is None:
-        msg = "--action argument must be passed. {}".format(add_help)
-        args.action = request_arg(args, msg, action_choices, True)
-        if args.action is None:
-            parser.error(msg)
+    return parser
+
+
+def get_default_args(**kwargs):
+    # The default value of every argument, with the keyword arguments passed in place of the command line.  The user
+    # interface is disabled.  Values are checked against the choices of the command line argument.
+    parser = get_arg_parser()
+    args = parser.parse_args([])
+    args.user_interface = False
+    choices_dict = {action.dest: action.choices for action in parser._actions if action.choices is not None}
+    for key, value in kwargs.items():
+        if key not in vars(args):
+            raise TypeError("Unknown argument {}".format(key))
+        if key in choices_dict and value is not None:
+            for item in [value] if isinstance(value, str) or not isinstance(value, (list, tuple)) else value:
+                if item not in choices_dict[key]:
+                    raise ValueError("Invalid {} {}, valid values are {}".format(
+                        key, item, ", ".join(str(choice) for choice in choices_dict[key])))
+        vars(args)[key] = value
+    if args.date_period is not None:
+        args.date_period = get_date_period_tuple(args.date_period)
+    if args.date_range not in [None, "Custom"]:
+        set_date_range(args)
+    return args
 
-    # See if we are missing any arguments
-    for a in args.action:
-        for key in actions_args_dict[a]:
-            # If argument was not passed
-            if key not in vars(args).keys() or vars(args)[key] is None:
-                msg = "The argument --{} is required when passing the argument --action {}. " \
-                      "{}".format(key, ", ".join(args.action), add_help)
-                if key == "date_period":
-                    vars(args)[key] = request_arg(args, msg, date_period_choices)
-                elif key == "date_range":
-                    vars(args)[key] = request_arg(args, msg, date_range_choices)
-                    set_date_range(args)
-                else:
-                    vars(args)[key] = request_arg(args, msg)
-                    if key not in vars(args).keys() or vars(args)[key] is None:
-                        parser.error(msg)
-            # if argument was passed but does not point to a valid file
-            elif key in valid_file_args and not os.path.exists(vars(args)[key]):
-                msg = "Argument --{} does not point to a valid file ({}). {}".format(key, vars(args)[key], add_help)
 
-                # Search for transaction files
-                for root, dirnames, filenames in os.walk(args.transactions_file_search_directory):
-                    for filename in fnmatch.filter(filenames, args.transactions_file_search_pattern):
-                        transaction_file_choices.insert(0, os.path.join(root, filename))
+def find_transactions_files(args):
+    # Every file in the search directory, or any directory below it, that matches the search pattern
+    transactions_file_list = []
+    for root, dirnames, filenames in os.walk(args.transactions_file_search_directory):
+        for filename in fnmatch.filter(filenames, args.transactions_file_search_pattern):
+            transactions_file_list.append(os.path.join(root, filename))
+    return transactions_file_list
 
-                # Query user to pick one of the found files or enter their own
-                vars(args)[key] = request_arg(args, msg, transaction_file_choices)
-                if not os.path.exists(vars(args)[key]):
-                    parser.error(msg)
 
-    return args
+def get_date_period_tuple(date_period):
+    # One date period or a list of them, a period that is repeated is only added up once
+    if isinstance(date_period, str):
+        return (date_period,)
+    return tuple(dict.fromkeys(date_period))
 
 
 def set_date_range(args):
@@ -326,27 +542,164 @@ def request_arg(args, msg, choices=None, allow_multiples=False):
 
 def main():
     args = get_args()
+
+    if args.watch:
+        watch_transactions(args, args.action)
+        return
+
+    # Run every action in a single pass over the transactions file
     for a in args.action:
-        # If this a multiple action run, we want to change the output file so that we don't overwrite results
-        if len(args.action) > 1:
-            split_file_json = os.path.splitext(args.output_file_json)
-            args.output_file_json = "{}-{}{}".format(split_file_json[0], a, split_file_json[1])
-            split_file_csv = os.path.splitext(args.output_file_csv)
-            args.output_file_csv = "{}-{}{}".format(split_file_csv[0], a, split_file_csv[1])
-
-        # Run action
         print("Running {} action".format(a))
-        if a == "GroupByPatternFile":
-            group_by_pattern_file(args)
-        elif a == "GroupByColumnValue":
-            group_by_column_value(args)
-        elif a == "GroupBySearchPattern":
-            group_by_search_pattern(args)
-        print("Output results to {} and {}".format(args.output_file_json, args.output_file_csv))
+    run_actions(args, args.action)
 
 
 def group_by_pattern_file(args):
-    category_dict = {}
+    run_actions(args, ["GroupByPatternFile"])
+
+
+def group_by_column_value(args):
+    run_actions(args, ["GroupByColumnValue"])
+
+
+def group_by_search_pattern(args):
+    run_actions(args, ["GroupBySearchPattern"])
+
+
+def run_actions(args, action_list):
+    profiler = Profiler() if args.profile else None
+    category_dict_list = group_transactions(args, action_list, profiler)
+
+    # Write date to files
+    write_json = save_transaction_json
+    write_csv = save_transaction_csv
+    if profiler is not None:
+        write_json = profiler.wrap("Write Json", save_transaction_json)
+        write_csv = profiler.wrap("Write Csv", save_transaction_csv)
+    for a, category_dict in zip(action_list, category_dict_list):
+        output_file_json, output_file_csv = get_output_files(args, a, action_list)
+        write_json(args, category_dict, output_file_json)
+        write_csv(args, category_dict, output_file_csv)
+        print("Output results to {} and {}".format(output_file_json,
+                                                   ", ".join(get_period_output_files(args, output_file_csv))))
+
+    if profiler is not None:
+        profiler.print_summary()
+        if args.profile_output:
+            profiler.save(args.profile_output)
+            print("Output profile to {}".format(args.profile_output))
+
+
+def get_output_files(args, action, action_list):
+    # If this a multiple action run, we want to change the output file so that we don't overwrite results
+    if len(action_list) > 1:
+        split_file_json = os.path.splitext(args.output_file_json)
+        split_file_csv = os.path.splitext(args.output_file_csv)
+        return "{}-{}{}".format(split_file_json[0], action, split_file_json[1]), \
+            "{}-{}{}".format(split_file_csv[0], action, split_file_csv[1])
+    return args.output_file_json, args.output_file_csv
+
+
+class Parser:
+    # Groups transactions without going through the command line, for long running processes that group many exports.
+    # Keyword arguments are the command line arguments without the dashes.  The patterns are compiled and the category
+    # cache is built once, then reused by every call to group().  Patterns can be passed as a dict of categories to
+    # lists of Regular Expressions instead of a --pattern_file.
+    unsupported_arg_list = ["batch", "watch", "watch_port", "checkpoint_file", "transactions_store_file",
+                            "date_index_file", "workers"]
+
+    def __init__(self, action_list, patterns=None, date_period="Monthly", date_range="All", **kwargs):
+        for key in self.unsupported_arg_list:
+            if key in kwargs:
+                raise TypeError("{} can only be used from the command line".format(key))
+        self.action_list = list(action_list)
+        self.args = get_default_args(action=self.action_list, date_period=date_period, date_range=date_range,
+                                     **kwargs)
+        if self.args.engine == "Columnar" and numpy is None:
+            raise ImportError("engine Columnar requires numpy, install it with \"pip install numpy\" or pass "
+                              "engine=\"Rows\"")
+
+        if "GroupBySearchPattern" in self.action_list and self.args.search_pattern is None:
+            raise TypeError("GroupBySearchPattern requires a search_pattern")
+
+        category_matcher = None
+        if type(patterns) is CategoryMatcher:
+            category_matcher = patterns
+        elif patterns is not None:
+            # Same checks as a --pattern_file
+            pattern_error = get_pattern_error(patterns)
+            if pattern_error:
+                raise TypeError("patterns are invalid: {}".format(pattern_error))
+            category_matcher = CategoryMatcher(patterns)
+        elif "GroupByPatternFile" in self.action_list:
+            # Errors are raised instead of stopping the process
+            category_matcher = load_pattern_file(self.args)
+        self.category_cache = None
+        if "GroupByPatternFile" in self.action_list and self.args.category_cache_size > 0:
+            self.category_cache = CategoryCache(self.args.category_cache_size)
+        self.categorize_list = [
+            get_action_categorize(self.args, a, self.category_cache, category_matcher=category_matcher)
+            for a in self.action_list
+        ]
+
+    def group(self, transactions, encoding=None):
+        # Transactions can be a path, a file object opened in text or binary mode, the bytes of a transactions file, or
+        # an iterable of lines.  Rows can also be passed as dicts of column names to values, or as lists of values after
+        # a list of column names.  Returns a ParserResult for each action.
+        row_iterator = get_transaction_rows(self.args, transactions, encoding)
+        category_dict_list = group_transactions_chunk(self.args, self.action_list, category_cache=self.category_cache,
+                                                      row_iterator=row_iterator, categorize_list=self.categorize_list)
+        return [
+            ParserResult(self.args, a, category_dict) for a, category_dict in zip(self.action_list, category_dict_list)
+        ]
+
+
+class ParserResult:
+    # The grouped transactions of one action returned by Parser.group(), category_dict maps each key to its
+    # CategoryAccumulator
+    __slots__ = ("args", "action", "category_dict")
+
+    def __init__(self, args, action, category_dict):
+        self.args = args
+        self.action = action
+        self.category_dict = category_dict
+
+    def to_dict(self):
+        # The same dict that is written to the json output
+        include_transactions = self.args.transaction_retention != "None"
+        category_dict = self.category_dict
+        if self.args.amount_cents:
+            category_dict = {key: value.from_cents() for key, value in category_dict.items()}
+        return {
+            key: category_dict[key].to_dict(self.args.date_period, include_transactions)
+            for key in sorted(category_dict)
+        }
+
+    def to_json(self):
+        file_out = io.StringIO()
+        write_transaction_json(self.args, self.category_dict, file_out)
+        return file_out.getvalue()
+
+    def to_csv(self, date_period=None):
+        # The csv of one date period, the first one if none is passed
+        period_index = 0 if date_period is None else self.args.date_period.index(date_period)
+        file_out = io.StringIO(newline='')
+        write_transaction_csv(self.args, self.category_dict, file_out, period_index)
+        return file_out.getvalue()
+
+    def save_json(self, output_file_json):
+        save_transaction_json(self.args, self.category_dict, output_file_json)
+
+    def save_csv(self, output_file_csv):
+        save_transaction_csv(self.args, self.category_dict, output_file_csv)
+
+
+def group_transactions(args, action_list, profiler=None):
+    if args.engine == "Columnar" and numpy is None:
+        print("Error: --engine Columnar requires numpy. Install it with \"pip install numpy\" or pass --engine Rows.")
+        exit(1)
+
+    if args.batch:
+        return group_transactions_batch(args, action_list, profiler)
 
     # Check that transactions file is valid path before opening
     if not os.path.exists(args.transactions_file):
@@ -354,273 +707,2027 @@ def group_by_pattern_file(args):
         print("Override by passing path to --transactions_file if needed.")
         exit(1)
 
-    # Read in all transactions
-    with open(args.transactions_file, 'r') as file_in_transactions:
-        file_lines = file_in_transactions.readlines()
+    # Only group the rows that were appended since the checkpoint was saved.  Rows appended while this run is going are
+    # left for the next one, and so is a last row that is still being written.
+    file_size = os.path.getsize(args.transactions_file)
+    category_dict_list, start_offset = None, None
+    end_offset = file_size
+    if args.checkpoint_file:
+        category_dict_list, start_offset = load_checkpoint(args, action_list, file_size)
+        end_offset = get_full_row_offset(args.transactions_file, start_offset or 0, file_size)
+
+    if args.transactions_store_file:
+        load_transaction_store(args, file_size)
+
+    if args.date_index_file and (args.start_date or args.end_date):
+        load_date_index(args, file_size)
+
+    category_cache = None
+    if "GroupByPatternFile" in action_list and args.category_cache_size > 0:
+        category_cache = load_category_cache(args)
+
+    workers = args.workers or os.cpu_count() or 1
+    if workers == 1:
+        category_dict_list = group_transactions_chunk(args, action_list, start_offset, end_offset, category_dict_list,
+                                                      category_cache, profiler)
+    else:
+        # Load the pattern file here so any errors are reported once instead of by every worker
+        for a in action_list:
+            get_action_categorize(args, a)
+
+        # Each worker groups the rows of one chunk, partial results are merged in file order.  get_args() turns on
+        # --amount_cents so the merged totals match a serial run.
+        if category_dict_list is None:
+            category_dict_list = [{} for a in action_list]
+        chunk_list = get_transaction_chunks(args, workers, start_offset, end_offset)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            future_list = [
+                executor.submit(group_transactions_worker, args, action_list, chunk_start_offset, chunk_end_offset,
+                                category_cache, profiler is not None)
+                for chunk_start_offset, chunk_end_offset in chunk_list
+            ]
+            for future in future_list:
+                partial_category_dict_list, partial_category_cache, partial_profiler = future.result()
+                for category_dict, partial_category_dict in zip(category_dict_list, partial_category_dict_list):
+                    merge_category_dict(args, category_dict, partial_category_dict)
+                if category_cache is not None:
+                    category_cache.update(partial_category_cache)
+                if profiler is not None:
+                    profiler.merge(partial_profiler)
+
+    if category_cache is not None and args.category_cache_file:
+        save_category_cache(args, category_cache)
+
+    if args.checkpoint_file:
+        save_checkpoint(args, action_list, category_dict_list, end_offset)
+
+    return category_dict_list
+
+
+def group_transactions_batch(args, action_list, profiler=None):
+    # Groups every transactions file found by the search pattern into one result, the files are read by a pool of
+    # threads and their rows are grouped in path order as they are read
+    transactions_file_list = sorted(find_transactions_files(args))
+    if not transactions_file_list:
+        print("Error: No files matching {} found in {}.".format(args.transactions_file_search_pattern,
+                                                               args.transactions_file_search_directory))
+        exit(1)
 
-    # Check that pattern file is valid path before opening
-    if not os.path.exists(args.pattern_file):
-        print("Error: {} not found.".format(args.pattern_file))
+    check_multiple_file_args(args, "batch")
+
+    category_cache = None
+    if "GroupByPatternFile" in action_list and args.category_cache_size > 0:
+        category_cache = load_category_cache(args)
+
+    print("Grouping {} transactions files from {}".format(len(transactions_file_list),
+                                                         args.transactions_file_search_directory))
+    workers = args.workers or os.cpu_count() or 1
+    stop_event = threading.Event()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            row_iterator_iterator = read_batch_files(args, executor, workers, transactions_file_list, stop_event)
+            category_dict_list = group_transactions_chunk(args, action_list, category_cache=category_cache,
+                                                          profiler=profiler,
+                                                          row_iterator=get_batch_rows(row_iterator_iterator))
+        finally:
+            # Readers still waiting for room in their queue give up so the pool can shut down
+            stop_event.set()
+
+    if category_cache is not None and args.category_cache_file:
+        save_category_cache(args, category_cache)
+
+    return category_dict_list
+
+
+def check_multiple_file_args(args, option):
+    # These only describe a single transactions file
+    for key in ["checkpoint_file", "transactions_store_file", "date_index_file"]:
+        if vars(args)[key]:
+            print("Error: --{} can't be used with --{}.".format(key, option))
+            exit(1)
+    if args.transaction_retention == "Offset":
+        print("Error: --transaction_retention Offset can't be used with --{} since the rows come from more than one "
+              "file.".format(option))
+        exit(1)
+
+
+def read_batch_files(args, executor, workers, transactions_file_list, stop_event):
+    # Yields an iterator over the rows of each file in path order.  At most workers files are read at once and each one
+    # holds at most batch_queue_size blocks of rows, so memory use doesn't grow with the size of the files.
+    pending_deque = collections.deque()
+    for transactions_file in transactions_file_list:
+        row_queue = queue.Queue(maxsize=batch_queue_size)
+        future = executor.submit(read_batch_file, args, transactions_file, row_queue, stop_event)
+        pending_deque.append((row_queue, future))
+        # The next file is only started once the oldest one has been grouped
+        if len(pending_deque) == workers:
+            yield get_batch_file_rows(*pending_deque.popleft())
+    while pending_deque:
+        yield get_batch_file_rows(*pending_deque.popleft())
+
+
+def read_batch_file(args, transactions_file, row_queue, stop_event):
+    # Runs in a reader thread, the rows are passed on in blocks of batch_block_rows.  None marks the end of the file,
+    # read errors are raised by the future.
+    file_args = argparse.Namespace(**dict(vars(args), transactions_file=transactions_file))
+    try:
+        row_list = []
+        for row in read_transaction_file(file_args):
+            row_list.append(row)
+            if len(row_list) == batch_block_rows:
+                if not put_batch_rows(row_queue, row_list, stop_event):
+                    return
+                row_list = []
+        if row_list:
+            put_batch_rows(row_queue, row_list, stop_event)
+    finally:
+        put_batch_rows(row_queue, None, stop_event)
+
+
+def put_batch_rows(row_queue, row_list, stop_event):
+    # Waits for room in the queue, returns False once the rows are no longer wanted
+    while not stop_event.is_set():
+        try:
+            row_queue.put(row_list, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def get_batch_file_rows(row_queue, future):
+    while True:
+        row_list = row_queue.get()
+        if row_list is None:
+            break
+        yield from row_list
+    future.result()
+
+
+def get_batch_rows(row_iterator_iterator):
+    seen_count_dict = {}
+    for row_iterator in row_iterator_iterator:
+        yield from get_unseen_rows(row_iterator, seen_count_dict, {})
+
+
+def get_unseen_rows(row_iterable, seen_count_dict, file_count_dict):
+    # Rows are matched on their column values.  A row is grouped once for each time it shows up in a single file, so a
+    # transaction repeated inside of one export is kept while the same transaction in an overlapping export is skipped.
+    for row in row_iterable:
+        row_key = row.get_text([])
+        file_count = file_count_dict[row_key] = file_count_dict.get(row_key, 0) + 1
+        if file_count > seen_count_dict.get(row_key, 0):
+            seen_count_dict[row_key] = file_count
+            yield row
+
+
+def watch_transactions(args, action_list):
+    # Polls the transactions files and pattern file until interrupted, the results are served on --watch_port
+    if args.engine == "Columnar" and numpy is None:
+        print("Error: --engine Columnar requires numpy. Install it with \"pip install numpy\" or pass --engine Rows.")
+        exit(1)
+    check_multiple_file_args(args, "watch")
+    watcher = TransactionsWatcher(args, action_list)
+
+    server = None
+    if args.watch_port is not None:
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", args.watch_port), WatchRequestHandler)
+        server.watcher = watcher
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print("Serving results on http://127.0.0.1:{}/".format(server.server_address[1]))
+
+    print("Watching {} for {} every {}s, press Ctrl+C to stop".format(
+        args.transactions_file_search_directory, args.transactions_file_search_pattern, args.watch_interval))
+    try:
+        while True:
+            if watcher.poll():
+                watcher.save_outputs()
+            time.sleep(args.watch_interval)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+
+class TransactionsWatcher:
+    # Grouped results of --watch kept between polls.  For every transactions file the offset of the rows grouped so far
+    # and a hash of those bytes are saved, so a file that only grew has just its new rows grouped.  A file that was
+    # removed or rewritten, or a change to the pattern file, groups every file again.
+    __slots__ = ("args", "action_list", "pattern_file_stat", "pattern_file_hash", "categorize_list", "category_cache",
+                 "watched_file_dict", "seen_count_dict", "category_dict_list", "update_time", "lock")
+
+    def __init__(self, args, action_list):
+        self.args = args
+        self.action_list = list(action_list)
+        self.pattern_file_stat = None
+        self.pattern_file_hash = None
+        self.categorize_list = None
+        self.category_cache = None
+        self.lock = threading.Lock()
+        self.update_time = None
+        self.load_patterns()
+        self.reset()
+
+    def reset(self):
+        self.watched_file_dict = {}
+        self.seen_count_dict = {}
+        with self.lock:
+            self.category_dict_list = [{} for a in self.action_list]
+
+    def load_patterns(self):
+        # Returns True if the pattern file changed and was compiled again
+        if "GroupByPatternFile" not in self.action_list:
+            if self.categorize_list is None:
+                self.categorize_list = [get_action_categorize(self.args, a) for a in self.action_list]
+            return False
+
+        try:
+            pattern_file_stat = os.stat(self.args.pattern_file)
+            pattern_file_stat = (pattern_file_stat.st_size, pattern_file_stat.st_mtime_ns)
+        except OSError:
+            pattern_file_stat = None
+        if self.categorize_list is not None and pattern_file_stat == self.pattern_file_stat:
+            return False
+        self.pattern_file_stat = pattern_file_stat
+        pattern_file_hash = get_file_hash(self.args.pattern_file) if pattern_file_stat is not None else None
+        if self.categorize_list is not None and pattern_file_hash == self.pattern_file_hash:
+            return False
+
+        # Keep the previous patterns while the pattern file can't be loaded, it is probably still being edited
+        category_cache = None
+        if self.args.category_cache_size > 0:
+            category_cache = load_category_cache(self.args) if self.categorize_list is None else \
+                CategoryCache(self.args.category_cache_size)
+        try:
+            categorize_list = [get_action_categorize(self.args, a, category_cache) for a in self.action_list]
+        except SystemExit:
+            if self.categorize_list is None:
+                raise
+            print("Keeping the previous patterns until {} is fixed".format(self.args.pattern_file))
+            return False
+        if self.categorize_list is not None:
+            print("Reloaded {}".format(self.args.pattern_file))
+        self.pattern_file_hash = pattern_file_hash
+        self.categorize_list = categorize_list
+        self.category_cache = category_cache
+        return True
+
+    def poll(self):
+        # Groups whatever changed since the last poll, returns True if the results changed
+        changed = False
+        if self.load_patterns():
+            self.reset()
+            changed = True
+
+        file_stat_dict = {}
+        for transactions_file in find_transactions_files(self.args):
+            try:
+                file_stat = os.stat(transactions_file)
+            except OSError:
+                continue
+            file_stat_dict[transactions_file] = (file_stat.st_size, file_stat.st_mtime_ns)
+
+        # Results can't be taken back out, so a file that lost rows means grouping everything again
+        for transactions_file, watched_file in self.watched_file_dict.items():
+            file_stat = file_stat_dict.get(transactions_file)
+            if file_stat == watched_file.file_stat:
+                continue
+            if file_stat is None or file_stat[0] < watched_file.row_offset or \
+                    get_file_hash(transactions_file, watched_file.row_offset) != watched_file.row_hash:
+                print("{} was removed or rewritten, grouping every transactions file again".format(transactions_file))
+                self.reset()
+                changed = True
+                break
+
+        # Only full rows are grouped, a row that is still being written is left for the next poll
+        read_list = []
+        for transactions_file in sorted(file_stat_dict):
+            watched_file = self.watched_file_dict.get(transactions_file) or WatchedFile()
+            file_stat = file_stat_dict[transactions_file]
+            if file_stat == watched_file.file_stat:
+                continue
+            watched_file.file_stat = file_stat
+            end_offset = get_full_row_offset(transactions_file, watched_file.row_offset, file_stat[0])
+            if end_offset > watched_file.row_offset:
+                read_list.append((transactions_file, watched_file, end_offset))
+        if not read_list:
+            return changed
+
+        print("Grouping new rows of {} transactions files".format(len(read_list)))
+        category_dict_list = group_transactions_chunk(self.args, self.action_list, category_cache=self.category_cache,
+                                                      row_iterator=self.read_new_rows(read_list),
+                                                      categorize_list=self.categorize_list)
+        with self.lock:
+            for category_dict, partial_category_dict in zip(self.category_dict_list, category_dict_list):
+                merge_category_dict(self.args, category_dict, partial_category_dict)
+            self.update_time = datetime.now()
+        if self.category_cache is not None and self.args.category_cache_file:
+            save_category_cache(self.args, self.category_cache)
+        return True
+
+    def read_new_rows(self, read_list):
+        for transactions_file, watched_file, end_offset in read_list:
+            file_args = argparse.Namespace(**dict(vars(self.args), transactions_file=transactions_file))
+            yield from get_unseen_rows(read_transaction_file(file_args, watched_file.row_offset, end_offset),
+                                       self.seen_count_dict, watched_file.file_count_dict)
+            watched_file.row_offset = end_offset
+            watched_file.row_hash = get_file_hash(transactions_file, end_offset)
+            self.watched_file_dict[transactions_file] = watched_file
+
+    def save_outputs(self):
+        for a, category_dict in zip(self.action_list, self.category_dict_list):
+            output_file_json, output_file_csv = get_output_files(self.args, a, self.action_list)
+            save_transaction_json(self.args, category_dict, output_file_json)
+            save_transaction_csv(self.args, category_dict, output_file_csv)
+            print("Output results to {} and {}".format(output_file_json,
+                                                       ", ".join(get_period_output_files(self.args, output_file_csv))))
+
+    def get_status(self):
+        with self.lock:
+            return {
+                "Actions": self.action_list,
+                "Files": {transactions_file: watched_file.row_offset for transactions_file, watched_file in
+                          self.watched_file_dict.items()},
+                "Last Update": self.update_time.isoformat(timespec="seconds") if self.update_time else None,
+            }
+
+    def get_json(self, action):
+        file_out = io.StringIO()
+        with self.lock:
+            write_transaction_json(self.args, self.category_dict_list[self.action_list.index(action)], file_out)
+        return file_out.getvalue()
+
+
+class WatchedFile:
+    # How much of a transactions file --watch has grouped.  file_count_dict counts each row of the file so overlapping
+    # exports are only grouped once, see get_unseen_rows().
+    __slots__ = ("row_offset", "row_hash", "file_count_dict", "file_stat")
+
+    def __init__(self):
+        self.row_offset = 0
+        self.row_hash = None
+        self.file_count_dict = {}
+        self.file_stat = None
+
+
+class WatchRequestHandler(http.server.BaseHTTPRequestHandler):
+    # Serves the results of --watch, / lists the actions and files and /ACTION returns the json results of an action
+
+    def do_GET(self):
+        watcher = self.server.watcher
+        action = self.path.split("?")[0].strip("/")
+        if not action:
+            body = json.dumps(watcher.get_status(), indent=4, ensure_ascii=False)
+        elif action in watcher.action_list:
+            body = watcher.get_json(action)
+        else:
+            self.send_error(404, "Unknown action {}".format(action))
+            return
+
+        body_bytes = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body_bytes)))
+        self.end_headers()
+        self.wfile.write(body_bytes)
+
+    def log_message(self, format, *args):
+        # Don't print every request
+        pass
+
+
+def get_full_row_offset(transactions_file, start_offset, file_size):
+    # Offset just past the last full row after start_offset, or start_offset if there is none.  start_offset must be the
+    # start of a row.  A newline inside of a quoted column doesn't end the row, so the quotes are counted to tell the
+    # newlines between rows from the ones inside of a column.
+    with open(transactions_file, 'rb') as file_in:
+        quote_count = count_quotes(file_in, start_offset, file_size)
+        end_offset = file_size
+        while end_offset > start_offset:
+            block_start_offset = max(start_offset, end_offset - read_buffer_size)
+            file_in.seek(block_start_offset)
+            block = file_in.read(end_offset - block_start_offset)
+
+            # quote_count is the number of quotes between start_offset and the newline being checked
+            search_end_index = len(block)
+            newline_index = block.rfind(b"\n")
+            while newline_index >= 0:
+                quote_count -= block.count(b'"', newline_index, search_end_index)
+                if quote_count % 2 == 0:
+                    return block_start_offset + newline_index + 1
+                search_end_index = newline_index
+                newline_index = block.rfind(b"\n", 0, newline_index)
+            quote_count -= block.count(b'"', 0, search_end_index)
+            end_offset = block_start_offset
+    return start_offset
+
+
+def count_quotes(file_in, start_offset, end_offset):
+    # Number of quote characters between two offsets of a binary file
+    quote_count = 0
+    file_in.seek(start_offset)
+    remaining = end_offset - start_offset
+    while remaining > 0:
+        block = file_in.read(min(read_buffer_size, remaining))
+        if not block:
+            break
+        quote_count += block.count(b'"')
+        remaining -= len(block)
+    return quote_count
+
+
+def group_transactions_worker(args, action_list, start_offset, end_offset, category_cache, profile):
+    # Runs in a worker process, the category cache and profiler are returned so the main process can merge them
+    profiler = Profiler() if profile else None
+    category_dict_list = group_transactions_chunk(args, action_list, start_offset, end_offset, None, category_cache,
+                                                  profiler)
+    return category_dict_list, category_cache, profiler
+
+
+def group_transactions_chunk(args, action_list, start_offset=None, end_offset=None, category_dict_list=None,
+                             category_cache=None, profiler=None, row_iterator=None, categorize_list=None):
+    if args.engine == "Columnar":
+        partial_category_dict_list = group_transactions_columnar(args, action_list, start_offset, end_offset,
+                                                                 category_cache, profiler, row_iterator,
+                                                                 categorize_list)
+        if category_dict_list is None:
+            return partial_category_dict_list
+        for category_dict, partial_category_dict in zip(category_dict_list, partial_category_dict_list):
+            merge_category_dict(args, category_dict, partial_category_dict)
+        return category_dict_list
+
+    # Each row is read and parsed once, then handed to every action
+    if categorize_list is None:
+        categorize_list = [get_action_categorize(args, a, category_cache, profiler) for a in action_list]
+    if category_dict_list is None:
+        category_dict_list = [{} for a in action_list]
+    retention = args.transaction_retention
+
+    # Rows read from the transaction store have their dates and amounts parsed once per distinct value
+    store_date_key_list = store_date_in_range_list = store_amount_list = None
+    if args.transactions_store_file:
+        store_date_key_list, store_date_in_range_list, store_amount_list = get_stored_dates_and_amounts(
+            args, open_transaction_store(args.transactions_store_file))
+
+    # Amounts repeat a lot, so each distinct amount is only parsed once
+    amount_dict = {}
+    signed_amounts = args.signed_amounts
+
+    # When profiling, time every stage of the loop
+    if row_iterator is None:
+        row_iterator = read_transactions(args, start_offset, end_offset, profiler)
+    get_date_key_function = get_date_key
+    get_amount_function = get_amount
+    is_date_in_valid_range_function = is_date_in_valid_range
+    add_transaction_function = add_transaction_json
+    if profiler is not None:
+        row_iterator = profiler.wrap_iterator("Read File", row_iterator)
+        get_date_key_function = profiler.wrap("Date Key", get_date_key)
+        get_amount_function = profiler.wrap("Parse Amount", get_amount)
+        is_date_in_valid_range_function = profiler.wrap("Date Range", is_date_in_valid_range)
+        add_transaction_function = profiler.wrap("Add Transaction", add_transaction_json)
+        categorize_list = [
+            profiler.wrap("Categorize {}".format(a), categorize) for a, categorize in zip(action_list, categorize_list)
+        ]
+
+    for row in row_iterator:
+        if store_date_key_list is not None:
+            date_id = row.get_id(args.date_column)
+            if not store_date_in_range_list[date_id]:
+                continue
+            date_key = store_date_key_list[date_id]
+            amount_flt = store_amount_list[row.get_id(args.amount_column)]
+        else:
+            # Extract date and make date formats match
+            date_str = row.get(args.date_column)
+            date_key = get_date_key_function(args, date_str)
+
+            # Extract amount
+            amount_str = row.get(args.amount_column)
+            amount_flt = amount_dict.get(amount_str)
+            if amount_flt is None:
+                amount_flt = amount_dict[amount_str] = get_amount_function(amount_str, args.amount_cents)
+
+            if not is_date_in_valid_range_function(args, date_str):
+                continue
+
+        if signed_amounts and is_debit(row.get(args.transaction_type_column)):
+            amount_flt = -amount_flt
+
+        # Keep the whole line, just where the row is in the transactions file, or nothing at all
+        if retention == "Full":
+            transaction = row.line
+        elif retention == "Offset":
+            transaction = row.offset
+        else:
+            transaction = None
+
+        for categorize, category_dict in zip(categorize_list, category_dict_list):
+            key = categorize(row)
+            if key is not None:
+                # Save to category_dict
+                add_transaction_function(args, category_dict, key, date_key, amount_flt, transaction)
+
+    return category_dict_list
+
+
+def group_transactions_columnar(args, action_list, start_offset=None, end_offset=None, category_cache=None,
+                                profiler=None, row_iterator=None, categorize_list=None):
+    # Collects the period, amount and key of every row into compact arrays, then adds them up with vectorized group by
+    # reductions.  Dates are only parsed and checked against the date range once per distinct date.
+    if categorize_list is None:
+        categorize_list = [get_action_categorize(args, a, category_cache, profiler) for a in action_list]
+    if row_iterator is None:
+        row_iterator = read_transactions(args, start_offset, end_offset, profiler)
+    if profiler is not None:
+        row_iterator = profiler.wrap_iterator("Read File", row_iterator)
+        categorize_list = [
+            profiler.wrap("Categorize {}".format(a), categorize) for a, categorize in zip(action_list, categorize_list)
+        ]
+    retention = args.transaction_retention
+
+    # Period id of each distinct date, or None if the date is outside of the date range
+    date_period_id_dict = {}
+    period_id_dict = {}
+    amount_dict = {}
+
+    # Rows read from the transaction store have their dates and amounts parsed once per distinct value
+    store_period_id_list = store_amount_list = None
+    if args.transactions_store_file:
+        store_date_key_list, store_date_in_range_list, store_amount_list = get_stored_dates_and_amounts(
+            args, open_transaction_store(args.transactions_store_file))
+        store_period_id_list = [
+            period_id_dict.setdefault(date_key, len(period_id_dict)) if date_in_range else None
+            for date_key, date_in_range in zip(store_date_key_list, store_date_in_range_list)
+        ]
+
+    period_id_array = array.array('l')
+    amount_array = array.array('d')
+    amount_is_float_array = array.array('b')
+    key_id_dict_list = [{} for a in action_list]
+    key_id_array_list = [array.array('l') for a in action_list]
+    transaction_list = []
+    for row in row_iterator:
+        if store_period_id_list is not None:
+            period_id = store_period_id_list[row.get_id(args.date_column)]
+        else:
+            date_str = row.get(args.date_column)
+            if date_str in date_period_id_dict:
+                period_id = date_period_id_dict[date_str]
+            else:
+                date_key = get_date_key(args, date_str)
+                period_id = None
+                if is_date_in_valid_range(args, date_str):
+                    period_id = period_id_dict.setdefault(date_key, len(period_id_dict))
+                date_period_id_dict[date_str] = period_id
+        if period_id is None:
+            continue
+
+        # get_amount() returns an int for amounts it can't read, keep track of them so the totals have the same type.
+        # Amounts in cents are always ints.
+        if store_amount_list is not None:
+            amount_flt = store_amount_list[row.get_id(args.amount_column)]
+        else:
+            amount_str = row.get(args.amount_column)
+            amount_flt = amount_dict.get(amount_str)
+            if amount_flt is None:
+                amount_flt = amount_dict[amount_str] = get_amount(amount_str, args.amount_cents)
+        if args.signed_amounts and is_debit(row.get(args.transaction_type_column)):
+            amount_flt = -amount_flt
+        period_id_array.append(period_id)
+        amount_array.append(amount_flt)
+        amount_is_float_array.append(args.amount_cents or type(amount_flt) is float)
+
+        for categorize, key_id_dict, key_id_array in zip(categorize_list, key_id_dict_list, key_id_array_list):
+            key = categorize(row)
+            if key is None:
+                key_id_array.append(-1)
+            else:
+                key_id_array.append(key_id_dict.setdefault(key, len(key_id_dict)))
+
+        if retention == "Full":
+            transaction_list.append(row.line)
+        elif retention == "Offset":
+            transaction_list.append(row.offset)
+
+    add_columns = add_transaction_columns
+    if profiler is not None:
+        add_columns = profiler.wrap("Add Transaction", add_transaction_columns)
+
+    period_column_list = get_period_columns(args, list(period_id_dict.keys()),
+                                            numpy.frombuffer(period_id_array, dtype=period_id_array.typecode))
+    amounts = numpy.frombuffer(amount_array, dtype=amount_array.typecode)
+    amounts_is_float = numpy.frombuffer(amount_is_float_array, dtype=amount_is_float_array.typecode)
+    return [
+        add_columns(list(key_id_dict.keys()), numpy.frombuffer(key_id_array, dtype=key_id_array.typecode),
+                    period_column_list, amounts, amounts_is_float, transaction_list if retention != "None" else None)
+        for key_id_dict, key_id_array in zip(key_id_dict_list, key_id_array_list)
+    ]
+
+
+def get_period_columns(args, date_key_list, date_key_ids):
+    # Rows are collected with the id of their date key, which holds a key for every --date_period.  Each date period
+    # gets its own list of period keys and period id of every row, with the periods in the order they first show up.
+    period_column_list = []
+    for period_index in range(len(args.date_period)):
+        period_id_dict = {}
+        period_id_list = [
+            period_id_dict.setdefault(date_key[period_index], len(period_id_dict)) for date_key in date_key_list
+        ]
+        period_ids = numpy.array(period_id_list, dtype=date_key_ids.dtype)[date_key_ids]
+        period_column_list.append((list(period_id_dict.keys()), period_ids))
+    return period_column_list
+
+
+def add_transaction_columns(key_list, key_ids, period_column_list, amounts, amounts_is_float, transaction_list):
+    # Rows the action skipped have a key id of -1
+    row_indexes = numpy.flatnonzero(key_ids >= 0)
+    key_ids = key_ids[row_indexes]
+    amounts = amounts[row_indexes]
+    amounts_is_float = amounts_is_float[row_indexes]
+
+    # bincount adds the weights in row order, so each sum matches adding the transactions one at a time
+    key_count = len(key_list)
+    total_list = numpy.bincount(key_ids, weights=amounts, minlength=key_count).tolist()
+    total_is_float_list = (numpy.bincount(key_ids, weights=amounts_is_float, minlength=key_count) > 0).tolist()
+    transaction_count_list = numpy.bincount(key_ids, minlength=key_count).tolist()
+
+    category_dict = {}
+    for key, total, total_is_float, transaction_count in zip(key_list, total_list, total_is_float_list,
+                                                             transaction_count_list):
+        category_accumulator = category_dict[key] = CategoryAccumulator(len(period_column_list))
+        category_accumulator.total = total if total_is_float else 0
+        category_accumulator.transaction_count = transaction_count
+
+    # Group by (key, period) pairs of each date period, periods are added to each key in the order they first show up
+    for period_index, (period_key_list, period_ids) in enumerate(period_column_list):
+        period_ids = period_ids[row_indexes]
+        period_count = max(len(period_key_list), 1)
+        pair_ids, first_indexes, pair_indexes = numpy.unique(
+            key_ids * period_count + period_ids, return_index=True, return_inverse=True)
+        pair_total_list = numpy.bincount(pair_indexes, weights=amounts, minlength=len(pair_ids)).tolist()
+        pair_is_float_list = \
+            (numpy.bincount(pair_indexes, weights=amounts_is_float, minlength=len(pair_ids)) > 0).tolist()
+        pair_id_list = pair_ids.tolist()
+        for pair_index in numpy.argsort(first_indexes, kind="stable").tolist():
+            key_id, period_id = divmod(pair_id_list[pair_index], period_count)
+            category_dict[key_list[key_id]].period_totals_list[period_index][period_key_list[period_id]] = \
+                pair_total_list[pair_index] if pair_is_float_list[pair_index] else 0
+
+    # Split the kept transactions by key, keeping the order of the transactions file
+    if transaction_list is not None:
+        sorted_row_index_list = row_indexes[numpy.argsort(key_ids, kind="stable")].tolist()
+        start_index = 0
+        for key, transaction_count in zip(key_list, transaction_count_list):
+            category_dict[key].transactions = [
+                transaction_list[row_index]
+                for row_index in sorted_row_index_list[start_index:start_index + transaction_count]
+            ]
+            start_index += transaction_count
+
+    return category_dict
+
+
+def get_transaction_chunks(args, count, start_offset=None, end_offset=None):
+    # Split the rows after the header into byte ranges of about the same size.  Each range starts on a row, so a quoted
+    # column holding a newline is never split between two chunks.
+    with open(args.transactions_file, 'rb') as file_in_transactions:
+        header_size = len(file_in_transactions.readline())
+    if start_offset is None or start_offset < header_size:
+        start_offset = header_size
+    if end_offset is None:
+        end_offset = os.path.getsize(args.transactions_file)
+    chunk_size = max(1, -(-(end_offset - start_offset) // count))
+    row_offset_list = get_row_offsets(args.transactions_file, start_offset,
+                                      range(start_offset + chunk_size, end_offset, chunk_size))
+    offset_list = [start_offset] + [min(row_offset, end_offset) for row_offset in row_offset_list] + [end_offset]
+    return [
+        (chunk_start_offset, chunk_end_offset)
+        for chunk_start_offset, chunk_end_offset in zip(offset_list, offset_list[1:])
+        if chunk_end_offset > chunk_start_offset
+    ]
+
+
+def get_row_offsets(transactions_file, row_start_offset, offset_list):
+    # Moves each of the sorted offsets forward to the start of the next row.  row_start_offset must be the start of a
+    # row, the quotes are counted from there to tell the newlines between rows from the ones inside of a column.
+    row_offset_list = []
+    with open(transactions_file, 'rb', buffering=read_buffer_size) as file_in:
+        position = row_start_offset
+        quote_count = 0
+        for offset in offset_list:
+            # An offset right after a newline is already the start of a row
+            if offset - 1 >= position:
+                quote_count += count_quotes(file_in, position, offset - 1)
+                position = offset - 1
+                file_in.seek(position)
+                while True:
+                    line = file_in.readline()
+                    if not line:
+                        break
+                    position += len(line)
+                    quote_count += line.count(b'"')
+                    if quote_count % 2 == 0:
+                        break
+            row_offset_list.append(position)
+    return row_offset_list
+
+
+def load_checkpoint(args, action_list, file_size):
+    # Returns the saved category dicts and the offset to continue reading from, or None for both if the checkpoint is
+    # missing or no longer matches the transactions file and arguments
+    if not os.path.exists(args.checkpoint_file):
+        return None, None
+
+    try:
+        with open(args.checkpoint_file, 'r') as file_in_checkpoint:
+            checkpoint_dict = json.load(file_in_checkpoint)
+    except ValueError as err:
+        print("Checkpoint {} is not valid json, grouping the whole transactions file.\n{}".format(
+            args.checkpoint_file, err))
+        return None, None
+
+    row_offset = checkpoint_dict.get("Row Offset")
+    if checkpoint_dict.get("Settings") != get_checkpoint_settings(args, action_list):
+        print("Checkpoint {} was saved with different arguments or pattern file, grouping the whole transactions "
+              "file.".format(args.checkpoint_file))
+        return None, None
+    if type(row_offset) is not int or row_offset > file_size:
+        print("Checkpoint {} is past the end of {}, grouping the whole transactions file.".format(
+            args.checkpoint_file, args.transactions_file))
+        return None, None
+
+    # The rows read last time must not have changed, and must have ended on a full line
+    with open(args.transactions_file, 'rb') as file_in_transactions:
+        file_in_transactions.seek(max(row_offset - 1, 0))
+        last_byte = file_in_transactions.read(1)
+    if get_file_hash(args.transactions_file, row_offset) != checkpoint_dict.get("Transactions Hash") or \
+            (row_offset < file_size and last_byte != b"\n"):
+        print("Checkpoint {} does not match the start of {}, grouping the whole transactions file.".format(
+            args.checkpoint_file, args.transactions_file))
+        return None, None
+
+    print("Resuming from checkpoint {} at byte {} of {}".format(args.checkpoint_file, row_offset, file_size))
+    category_dict_list = [
+        {key: CategoryAccumulator.from_state(value) for key, value in category_dict.items()}
+        for category_dict in checkpoint_dict["Category Dicts"]
+    ]
+    return category_dict_list, row_offset
+
+
+def save_checkpoint(args, action_list, category_dict_list, row_offset):
+    checkpoint_dict = {
+        "Settings": get_checkpoint_settings(args, action_list),
+        "Row Offset": row_offset,
+        "Transactions Hash": get_file_hash(args.transactions_file, row_offset),
+        "Category Dicts": [
+            {key: value.to_state() for key, value in category_dict.items()} for category_dict in category_dict_list
+        ],
+    }
+
+    # Write to a temporary file first so an interrupted run doesn't leave a broken checkpoint behind
+    temp_checkpoint_file = "{}.tmp".format(args.checkpoint_file)
+    with open(temp_checkpoint_file, 'w') as file_out:
+        json.dump(checkpoint_dict, file_out, ensure_ascii=False)
+    os.replace(temp_checkpoint_file, args.checkpoint_file)
+
+
+def get_checkpoint_settings(args, action_list):
+    # Everything that changes how rows are grouped, a checkpoint is only used if all of these still match
+    settings_dict = {
+        "action": list(action_list),
+        "transactions_file": os.path.abspath(args.transactions_file),
+        "date_period": list(args.date_period),
+        "date_format": args.date_format,
+        "date_column": args.date_column,
+        "amount_column": args.amount_column,
+        "start_date": args.start_date,
+        "end_date": args.end_date,
+        "transaction_retention": args.transaction_retention,
+    }
+    if args.signed_amounts:
+        settings_dict["signed_amounts"] = args.transaction_type_column
+    if args.amount_cents:
+        settings_dict["amount_cents"] = True
+    if args.fiscal_year_start_month != 1:
+        settings_dict["fiscal_year_start_month"] = args.fiscal_year_start_month
+    if "GroupByPatternFile" in action_list:
+        settings_dict["pattern_file_hash"] = get_file_hash(args.pattern_file)
+    if "GroupByColumnValue" in action_list:
+        settings_dict["categorize_column"] = args.categorize_column
+    if "GroupBySearchPattern" in action_list:
+        settings_dict["search_pattern"] = args.search_pattern
+    return settings_dict
+
+
+def get_file_hash(file_path, size=None):
+    # Hash the first size bytes of a file, or the whole file if no size is passed
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file_in:
+        remaining = size
+        while remaining is None or remaining > 0:
+            block = file_in.read(read_buffer_size if remaining is None else min(read_buffer_size, remaining))
+            if not block:
+                break
+            file_hash.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return file_hash.hexdigest()
+
+
+def get_action_categorize(args, action, category_cache=None, profiler=None, category_matcher=None):
+    # Returns a function that gives the key a row is grouped by, or None if the action skips the row
+    if action == "GroupByPatternFile":
+        if category_matcher is None:
+            category_matcher = load_pattern_file_or_exit(args)
+
+        def categorize(row):
+            # Find the first category with a matching pattern, record the transaction as NO_MATCH otherwise
+            key = category_matcher.match(row.line)
+            if key is None:
+                key = "NO_MATCH"
+            return key
+
+        if profiler is not None:
+            # Also time every pattern on its own to find the expensive ones
+            match_category = categorize
+            pattern_list = category_matcher.get_pattern_list()
+
+            def categorize(row):
+                profiler.time_patterns(pattern_list, row.line)
+                return match_category(row)
+
+        if category_cache is not None:
+            match_pattern_file = categorize
+            skip_column_list = [args.date_column, args.amount_column]
+
+            def categorize(row):
+                # Rows with the same text apart from the date and amount land in the same category
+                cache_key = row.get_text(skip_column_list)
+                key = category_cache.get(cache_key)
+                if key is None:
+                    key = match_pattern_file(row)
+                    category_cache.set(cache_key, key)
+                return key
+
+    elif action == "GroupByColumnValue":
+        def categorize(row):
+            # Extract column to group by
+            return row.get(args.categorize_column)
+
+    else:
+        search_regex = re.compile(args.search_pattern)
+
+        def categorize(row):
+            if search_regex.search(row.line):
+                return args.search_pattern
+            return None
+
+    return categorize
+
+
+def load_pattern_file_or_exit(args):
+    # Command line callers report a pattern file that can't be loaded and stop
+    try:
+        return load_pattern_file(args)
+    except FileNotFoundError as err:
+        print("Error: {}".format(err))
         print("Override by passing path to --pattern_file if needed.")
         exit(1)
+    except ValueError as err:
+        print("Error: {}".format(err))
+        exit(1)
+
+
+def load_pattern_file(args):
+    # Check that pattern file is valid path before opening
+    if not os.path.exists(args.pattern_file):
+        raise FileNotFoundError("{} not found.".format(args.pattern_file))
 
     # Read in all patterns
     try:
         with open(args.pattern_file, 'r') as file_in_pattern:
             category_dict_pattern = json.load(file_in_pattern)
+    except ValueError as err:
+        raise ValueError("{} is not valid json.\n{}".format(args.pattern_file, err))
 
-            # Check that json document is formatted correctly
-            for key, value in category_dict_pattern.items():
-                if type(key) is not str:
-                    print("Json Invalid: Expecting type str instead of {}: ({}: {})".format(type(key), key, value))
-                    exit(1)
-                elif type(value) is not list:
-                    print("Json Invalid: Expecting type list instead of {}: ({}: {})".format(type(value), key, value))
-                    exit(1)
-                else:
-                    for item in value:
-                        if type(item) is not str:
-                            print("Json Invalid: Expecting type str instead of {}: ({})".format(type(item), item))
-                            exit(1)
+    # Check that json document is formatted correctly
+    pattern_error = get_pattern_error(category_dict_pattern)
+    if pattern_error:
+        raise ValueError("{} is not a valid pattern file.\n{}".format(args.pattern_file, pattern_error))
+
+    # Compile all patterns once
+    try:
+        category_matcher = CategoryMatcher(category_dict_pattern)
+    except re.error as err:
+        raise ValueError("{} contains an invalid regular expression.\n{}".format(args.pattern_file, err))
 
+    return category_matcher
+
+
+def get_pattern_error(category_dict_pattern):
+    # Patterns have to be a dict of str categories to lists of str Regular Expressions, returns what is wrong or None
+    if type(category_dict_pattern) is not dict:
+        return "Expecting type dict instead of {}".format(type(category_dict_pattern))
+    for key, value in category_dict_pattern.items():
+        if type(key) is not str:
+            return "Expecting type str instead of {}: ({}: {})".format(type(key), key, value)
+        elif type(value) is not list:
+            return "Expecting type list instead of {}: ({}: {})".format(type(value), key, value)
+        for item in value:
+            if type(item) is not str:
+                return "Expecting type str instead of {}: ({})".format(type(item), item)
+    return None
+
+
+class CategoryCache:
+    # Least recently used map from a transaction's text to the category the pattern file put it in
+    __slots__ = ("max_size", "category_dict")
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.category_dict = collections.OrderedDict()
+
+    def get(self, cache_key):
+        key = self.category_dict.get(cache_key)
+        if key is not None:
+            self.category_dict.move_to_end(cache_key)
+        return key
+
+    def set(self, cache_key, key):
+        self.category_dict[cache_key] = key
+        if len(self.category_dict) > self.max_size:
+            self.category_dict.popitem(last=False)
+
+    def update(self, other):
+        for cache_key, key in other.category_dict.items():
+            self.set(cache_key, key)
+
+
+def load_category_cache(args):
+    category_cache = CategoryCache(args.category_cache_size)
+    if not args.category_cache_file or not os.path.exists(args.category_cache_file):
+        return category_cache
+
+    try:
+        with open(args.category_cache_file, 'r') as file_in_cache:
+            category_cache_dict = json.load(file_in_cache)
     except ValueError as err:
-        print("Error: {} is not valid json.\n{}".format(args.pattern_file, err))
-        exit(1)
+        print("Category cache {} is not valid json, starting with an empty cache.\n{}".format(
+            args.category_cache_file, err))
+        return category_cache
 
-    count = 0
-    header_text = ""
-    for line in file_lines:
-        # Don't parse first line
-        if count == 0:
-            header_text = line
-            count += 1
-            continue
+    # Saved categories are only valid for the exact pattern file they came from
+    if category_cache_dict.get("Pattern File Hash") == get_file_hash(args.pattern_file):
+        for cache_key, key in category_cache_dict.get("Categories", {}).items():
+            category_cache.set(cache_key, key)
+    return category_cache
 
-        # Extract date and make date formats match
-        date_str = get_column_value(args.date_column, line, header_text)
-        date_key = get_date_key(args, date_str)
 
-        # Extract amount
-        amount_str = get_column_value(args.amount_column, line, header_text)
-        match = re.search(r"\d+(\.\d+)?", amount_str)
-        if match:
-            amount_flt = float(match.group(0))
-        else:
-            amount_flt = 0
+def save_category_cache(args, category_cache):
+    category_cache_dict = {
+        "Pattern File Hash": get_file_hash(args.pattern_file),
+        "Categories": category_cache.category_dict,
+    }
+    temp_category_cache_file = "{}.tmp".format(args.category_cache_file)
+    with open(temp_category_cache_file, 'w') as file_out:
+        json.dump(category_cache_dict, file_out, ensure_ascii=False)
+    os.replace(temp_category_cache_file, args.category_cache_file)
 
-        found_match = False
-        for key, value in category_dict_pattern.items():
+
+def get_amount(amount_str, amount_cents=False):
+    # Fast path for plain amounts like 12.34, anything else is searched for the first number.  Thousands separators like
+    # 1,234.56 are dropped.  Returns an int 0 if there is no number.
+    if amount_str[:1].isdecimal() and amount_str.replace(".", "", 1).isdecimal():
+        amount_flt = float(amount_str)
+    else:
+        match = amount_regex.search(amount_str)
+        if not match:
+            return 0
+        amount_flt = float(match.group(0).replace(",", ""))
+
+    if amount_cents:
+        return round(amount_flt * 100)
+    return amount_flt
+
+
+def is_debit(transaction_type):
+    return transaction_type.lower() == "debit"
+
+
+class CategoryMatcher:
+    # Compiles a pattern file once so each transaction line can be categorized without looping over re.findall().
+    # Patterns that are only a literal wrapped in ".*" are really substring tests, so all of them are found with a single
+    # scan of the line.  The remaining patterns are combined into one alternation with a named group per category.
+    # Categories are checked in pattern file order so the first matching category still wins.
+    __slots__ = ("categories", "category_dict_pattern", "literal_regex", "literal_category_index", "pattern_regex",
+                 "pattern_list", "first_pattern_index")
+
+    def __init__(self, category_dict_pattern):
+        self.categories = list(category_dict_pattern.keys())
+        self.category_dict_pattern = category_dict_pattern
+
+        # Split the patterns into plain literals and real regular expressions
+        literal_index_dict = {}
+        pattern_index_list = []
+        for index, value in enumerate(category_dict_pattern.values()):
             for pattern in value:
-                match = re.findall(pattern, line)
-                if match and is_date_in_valid_range(args, date_str):
-                    found_match = True
+                # Make sure every pattern compiles on its own
+                re.compile(pattern)
 
-                    # Save to category_dict
-                    add_transaction_json(args, category_dict, key, date_key, amount_flt, line)
+                literal = get_pattern_literal(pattern)
+                if literal:
+                    literal_index_dict.setdefault(literal, index)
+                else:
+                    pattern_index_list.append((index, strip_pattern_wildcards(pattern)))
+
+        # Scanning with a lookahead reports every position a literal starts at, but only the longest literal for that
+        # position.  Any shorter literal starting there is a prefix of the one found, so map each literal to the first
+        # category of all the literals it contains.
+        self.literal_regex = None
+        self.literal_category_index = {}
+        if literal_index_dict:
+            literal_list = sorted(literal_index_dict.keys(), key=len, reverse=True)
+            self.literal_regex = re.compile("(?=({}))".format("|".join(re.escape(literal) for literal in literal_list)))
+            for literal in literal_list:
+                self.literal_category_index[literal] = min(
+                    index for sub_literal, index in literal_index_dict.items() if sub_literal in literal
+                )
+
+        # Combine the remaining patterns into one alternation anchored at the start of the line.  Each category is a
+        # lookahead that searches the whole line, alternatives are tried in order so the first category wins.
+        self.pattern_regex = None
+        self.pattern_list = []
+        self.first_pattern_index = len(self.categories)
+        if pattern_index_list:
+            self.first_pattern_index = pattern_index_list[0][0]
+            category_pattern_dict = {}
+            for index, pattern in pattern_index_list:
+                category_pattern_dict.setdefault(index, []).append(pattern)
+            self.pattern_list = [
+                (index, [re.compile(pattern) for pattern in value]) for index, value in category_pattern_dict.items()
+            ]
+
+            # Backreferences are numbered, they would point to the wrong group once the patterns are combined
+            if not any(re.search(r"\\[1-9]|\(\?P=", pattern) for index, pattern in pattern_index_list):
+                try:
+                    self.pattern_regex = re.compile("\\A(?:{})".format("|".join(
+                        "(?P<_category_{}>(?=[\\s\\S]*?(?:{})))".format(index, "|".join(value))
+                        for index, value in category_pattern_dict.items()
+                    )))
+                except re.error:
+                    # Patterns using inline flags or duplicate group names can't be combined, search them one at a time
+                    self.pattern_regex = None
+
+    def match(self, line):
+        # Find the first category with a literal in the line
+        best_index = len(self.categories)
+        if self.literal_regex is not None:
+            literal_list = self.literal_regex.findall(line)
+            if literal_list:
+                best_index = min(map(self.literal_category_index.__getitem__, literal_list))
+
+        # Only search the regular expressions if one of them belongs to an earlier category
+        if self.first_pattern_index < best_index:
+            if self.pattern_regex is not None:
+                match = self.pattern_regex.match(line)
+                if match:
+                    best_index = min(best_index, int(match.lastgroup.rsplit("_", 1)[1]))
+            else:
+                for index, pattern_list in self.pattern_list:
+                    if index >= best_index:
+                        break
+                    if any(pattern.search(line) for pattern in pattern_list):
+                        best_index = index
+                        break
+
+        if best_index < len(self.categories):
+            return self.categories[best_index]
+        return None
 
-                    # If match was found, then continue to next line
+    def get_pattern_list(self):
+        # Every pattern compiled on its own as (name, compiled pattern)
+        return [
+            ("{}: {}".format(key, pattern), re.compile(pattern))
+            for key, value in self.category_dict_pattern.items() for pattern in value
+        ]
+
+
+def get_pattern_literal(pattern):
+    # Returns the literal text of patterns like ".*Paycheck.*", or None if the pattern is a real regular expression
+    literal = strip_pattern_wildcards(pattern)
+    if not literal or any(c in literal for c in r".^$*+?{}[]\|()"):
+        return None
+    return literal
+
+
+def strip_pattern_wildcards(pattern):
+    # A leading or trailing ".*" doesn't change whether a pattern is found in a line, but it makes the search backtrack
+    if pattern.startswith(".*") and pattern[2:3] not in ("*", "+", "?", "{"):
+        pattern = pattern[2:]
+    if pattern.endswith(".*"):
+        # Leave an escaped "\.*" alone
+        backslash_count = len(pattern[:-2]) - len(pattern[:-2].rstrip("\\"))
+        if backslash_count % 2 == 0:
+            pattern = pattern[:-2]
+    return pattern
+
+
+def read_transactions(args, start_offset=None, end_offset=None, profiler=None):
+    # Read the rows from the transaction store when there is one, otherwise parse the transactions file.  With a date
+    # index only the rows inside of the date range are read.
+    offset_list = None
+    if args.date_index_file and (args.start_date or args.end_date):
+        offset_list = get_date_index_offsets(args, start_offset, end_offset)
+
+    if args.transactions_store_file:
+        store = open_transaction_store(args.transactions_store_file)
+        if offset_list is not None:
+            return read_stored_transactions_at(store, offset_list)
+        return read_stored_transactions(store, start_offset, end_offset)
+    if offset_list is not None:
+        return read_transaction_file_at(args, offset_list, profiler)
+    return read_transaction_file(args, start_offset, end_offset, profiler)
+
+
+def read_transaction_file(args, start_offset=None, end_offset=None, profiler=None):
+    # Stream the transactions file one row at a time so memory use doesn't grow with the size of the export.  The header
+    # is parsed once into a column index map that is shared by every row.  When a byte range is passed only the rows
+    # starting inside of it are returned, which lets the file be split into chunks.
+    encoding = locale.getpreferredencoding(False)
+    split_line = split_plain_transaction_line
+    if profiler is not None:
+        split_line = profiler.wrap("Split Columns", split_plain_transaction_line)
+    with open(args.transactions_file, 'rb', buffering=read_buffer_size) as file_in_transactions:
+        header_line = file_in_transactions.readline()
+        header_index = get_header_index(decode_line(header_line, encoding))
+        offset = len(header_line)
+
+        # Skip ahead to the first row that starts inside the range
+        if start_offset is not None and start_offset > offset:
+            file_in_transactions.seek(start_offset - 1)
+            offset = start_offset - 1 + len(file_in_transactions.readline())
+
+        file_in_lines = file_in_transactions
+        if args.read_ahead > 0:
+            file_in_lines = ReadAheadFile(file_in_transactions, args.read_ahead)
+        try:
+            for line in file_in_lines:
+                if end_offset is not None and offset >= end_offset:
                     break
-            if found_match:
+                row = TransactionRow(decode_line(line, encoding), header_index, offset, split_line)
+                if row.values is None:
+                    line = read_quoted_line(file_in_lines, line)
+                    row = TransactionRow(decode_line(line, encoding), header_index, offset)
+                yield row
+                offset += len(line)
+        finally:
+            if file_in_lines is not file_in_transactions:
+                file_in_lines.close()
+
+
+class ReadAheadFile:
+    # Lines of a binary file read by a background thread.  The thread keeps up to block_count blocks in a queue and
+    # waits while the queue is full, so memory use is bounded.  Reading a block releases the GIL, so waiting on the
+    # disk overlaps with the rows being grouped.  Only supports iterating over the lines and readline().
+    __slots__ = ("block_queue", "stop_event", "thread", "line_iterator", "partial_line")
+
+    def __init__(self, file_in, block_count):
+        self.block_queue = queue.Queue(maxsize=block_count)
+        self.stop_event = threading.Event()
+        self.line_iterator = iter([])
+        self.partial_line = b""
+        self.thread = threading.Thread(target=self.read_blocks, args=(file_in,), daemon=True)
+        self.thread.start()
+
+    def read_blocks(self, file_in):
+        # Runs in the background thread, an empty block marks the end of the file and read errors are passed on
+        while not self.stop_event.is_set():
+            try:
+                block = file_in.read(read_buffer_size)
+            except OSError as err:
+                block = err
+            while not self.stop_event.is_set():
+                try:
+                    self.block_queue.put(block, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if type(block) is not bytes or not block:
                 break
 
-        # Record the transaction if no pattern matched it
-        if not found_match and is_date_in_valid_range(args, date_str):
-            key = "NO_MATCH"
+    def read_lines(self):
+        # Split the next block into lines, a line cut off at the end of the block is finished by the next one.  Returns
+        # False at the end of the file.
+        block = self.block_queue.get()
+        if isinstance(block, OSError):
+            self.block_queue.put(block)
+            raise block
+        if not block:
+            self.block_queue.put(block)
+            if not self.partial_line:
+                return False
+            self.line_iterator = iter([self.partial_line])
+            self.partial_line = b""
+            return True
+
+        line_list = io.BytesIO(self.partial_line + block).readlines()
+        self.partial_line = b"" if line_list[-1].endswith(b"\n") else line_list.pop()
+        self.line_iterator = iter(line_list)
+        return True
 
-            # Save to category_dict
-            add_transaction_json(args, category_dict, key, date_key, amount_flt, line)
-        count += 1
+    def __iter__(self):
+        while True:
+            line_iterator = self.line_iterator
+            yield from line_iterator
+            # readline() may have already moved on to the next block
+            if line_iterator is self.line_iterator and not self.read_lines():
+                return
+
+    def readline(self):
+        line = next(self.line_iterator, None)
+        while line is None:
+            if not self.read_lines():
+                return b""
+            line = next(self.line_iterator, None)
+        return line
+
+    def close(self):
+        # Stop the thread before the file is closed
+        self.stop_event.set()
+        self.thread.join()
+
+
+def read_transaction_file_at(args, offset_list, profiler=None):
+    # Reads the rows starting at each offset, rows next to each other are read without seeking
+    encoding = locale.getpreferredencoding(False)
+    split_line = split_plain_transaction_line
+    if profiler is not None:
+        split_line = profiler.wrap("Split Columns", split_plain_transaction_line)
+    with open(args.transactions_file, 'rb', buffering=read_buffer_size) as file_in_transactions:
+        header_index = get_header_index(decode_line(file_in_transactions.readline(), encoding))
+        position = file_in_transactions.tell()
+        for offset in offset_list:
+            if offset != position:
+                file_in_transactions.seek(offset)
+            line = file_in_transactions.readline()
+            row = TransactionRow(decode_line(line, encoding), header_index, offset, split_line)
+            if row.values is None:
+                line = read_quoted_line(file_in_transactions, line)
+                row = TransactionRow(decode_line(line, encoding), header_index, offset)
+            position = offset + len(line)
+            yield row
+
+
+def get_transaction_rows(args, transactions, encoding=None):
+    # Rows from any of the inputs taken by Parser.group()
+    if isinstance(transactions, (str, os.PathLike)):
+        return read_transaction_file(argparse.Namespace(**dict(vars(args), transactions_file=transactions)))
+    if isinstance(transactions, (bytes, bytearray, memoryview)):
+        return read_transaction_lines(bytes(transactions).splitlines(keepends=True), encoding)
+    return read_transaction_lines(transactions, encoding)
+
+
+def read_transaction_lines(line_iterable, encoding=None):
+    # Rows from an iterable of lines, the first one is the header.  Lines can be bytes or str.  Rows can also be dicts of
+    # column names to values, or lists of values after a list of column names.  The offset of each row is its position
+    # in the input.
+    encoding = encoding or locale.getpreferredencoding(False)
+    line_iterator = iter(line_iterable)
+    header_line = next(line_iterator, None)
+    if header_line is None:
+        return
+
+    column_list = None
+    if isinstance(header_line, dict):
+        # The columns of the first row are the header
+        column_list = list(header_line)
+        line_iterator = itertools.chain([header_line], line_iterator)
+    elif isinstance(header_line, (list, tuple)):
+        column_list = list(header_line)
+    if column_list is not None:
+        header_line = format_transaction_line(column_list)
+    header_line = get_text_line(header_line, encoding)
+    header_index = get_header_index(header_line)
+
+    offset = len(header_line)
+    for line in line_iterator:
+        if isinstance(line, dict):
+            line = format_transaction_line([line.get(column, "") for column in column_list])
+        elif isinstance(line, (list, tuple)):
+            line = format_transaction_line(line)
+        else:
+            line = get_text_line(line, encoding)
+
+        row = TransactionRow(line, header_index, offset, split_plain_transaction_line)
+        if row.values is None:
+            # A quoted column can hold a newline, keep adding lines until the quotes are balanced
+            while line.count('"') % 2 == 1:
+                next_line = next(line_iterator, None)
+                if next_line is None:
+                    break
+                line += get_text_line(next_line, encoding)
+            row = TransactionRow(line, header_index, offset)
+        yield row
+        offset += len(line)
 
-    # Write date to files
-    save_transaction_json(args, category_dict)
-    save_transaction_csv(args, category_dict)
 
+def get_text_line(line, encoding):
+    if isinstance(line, str):
+        return line.replace("\r\n", "\n") if line.endswith("\r\n") else line
+    return decode_line(line, encoding)
 
-def group_by_column_value(args):
-    category_dict = {}
 
-    # Check that transactions file is valid path before opening
-    if not os.path.exists(args.transactions_file):
-        print("Error: {} not found.".format(args.transactions_file))
-        print("Override by passing path to --transactions_file if needed.")
-        exit(1)
+def format_transaction_line(value_list):
+    # Quote every column the same way as a Mint export
+    return '"{}"\n'.format('","'.join(str(value).replace('"', '""') for value in value_list))
 
-    # Read in all transactions
-    with open(args.transactions_file, 'r') as file_in_transactions:
-        file_lines = file_in_transactions.readlines()
 
-    count = 0
-    header_text = ""
-    for line in file_lines:
-        # Don't parse first line
-        if count == 0:
-            header_text = line
-            count += 1
-            continue
+def read_quoted_line(file_in, line):
+    # A quoted column can hold a newline, keep reading lines until the quotes are balanced
+    while line.count(b'"') % 2 == 1:
+        next_line = file_in.readline()
+        if not next_line:
+            break
+        line += next_line
+    return line
 
-        # Extract date and make date formats match
-        date_str = get_column_value(args.date_column, line, header_text)
-        date_key = get_date_key(args, date_str)
 
-        # Extract column to group by
-        column_key = get_column_value(args.categorize_column, line, header_text)
+def decode_line(line, encoding):
+    # Match the newline translation of a file opened in text mode, rows that span lines have a newline in the middle
+    if line.endswith(b"\r\n"):
+        line = line.replace(b"\r\n", b"\n")
+    return line.decode(encoding)
 
-        # Extract amount
-        amount_str = get_column_value(args.amount_column, line, header_text)
-        match = re.search(r"\d+(\.\d+)?", amount_str)
-        if match:
-            amount_flt = float(match.group(0))
-        else:
-            amount_flt = 0
 
-        # Save to category_dict
-        if is_date_in_valid_range(args, date_str):
-            add_transaction_json(args, category_dict, column_key, date_key, amount_flt, line)
+def get_header_index(header_line):
+    # Map each column name to its position, the first column wins if a name is repeated
+    header_index = {}
+    for index, column in enumerate(split_transaction_line(header_line)):
+        header_index.setdefault(column, index)
+    return header_index
 
-        count += 1
 
-    # Write date to files
-    save_transaction_json(args, category_dict)
-    save_transaction_csv(args, category_dict)
+def split_transaction_line(line):
+    line_split = split_plain_transaction_line(line)
+    if line_split is None:
+        # Quotes inside of a column, columns without quotes or a newline inside of a column
+        line_split = next(csv.reader([line]), [])
+    return line_split
 
 
-def group_by_search_pattern(args):
-    category_dict = {}
+def split_plain_transaction_line(line):
+    # Mint quotes every column, so when the only quotes in the line are the ones around each column the line is split
+    # on the separators between them.  Returns None for any other line, those are left to the csv module.
+    line_split = line.split("\",\"")
+    if line.count('"') == 2 * len(line_split) and line[0] == '"' == line[-2] and line[-1] == "\n":
+        line_split[0] = line_split[0][1:]
+        line_split[-1] = line_split[-1][:-2]
+        return line_split
+    return None
+
+
+class TransactionRow:
+    # A single transaction split into its columns once, columns are looked up by name through the header index map.
+    # The offset is the position of the row in the transactions file.
+    __slots__ = ("line", "values", "header_index", "offset")
+
+    def __init__(self, line, header_index, offset=None, split_line=split_transaction_line):
+        self.line = line
+        self.values = split_line(line)
+        self.header_index = header_index
+        self.offset = offset
+
+    def get(self, column):
+        index = self.header_index.get(column)
+        if index is None or index >= len(self.values):
+            return ""
+        return self.values[index]
+
+    def get_text(self, skip_column_list):
+        # All the column values except the skipped ones joined together
+        skip_index_set = {self.header_index.get(column) for column in skip_column_list}
+        return "\x1f".join(value for index, value in enumerate(self.values) if index not in skip_index_set)
+
+
+def load_transaction_store(args, file_size):
+    # Builds the transaction store if it is missing or no longer matches the transactions file
+    source_dict = get_transactions_source(args, file_size)
+    header_dict = None
+    if os.path.exists(args.transactions_store_file):
+        try:
+            header_dict = read_section_file_header(args.transactions_store_file, transaction_store_magic)[0]
+        except ValueError as err:
+            print("Transaction store {} is not valid, rebuilding it.\n{}".format(args.transactions_store_file, err))
 
-    # Check that transactions file is valid path before opening
-    if not os.path.exists(args.transactions_file):
-        print("Error: {} not found.".format(args.transactions_file))
-        print("Override by passing path to --transactions_file if needed.")
-        exit(1)
+    if header_dict is not None and is_transactions_source_unchanged(args, header_dict, source_dict):
+        return
 
-    # Read in all transactions
-    with open(args.transactions_file, 'r') as file_in_transactions:
-        file_lines = file_in_transactions.readlines()
+    print("Building transaction store {} from {}".format(args.transactions_store_file, args.transactions_file))
+    build_transaction_store(args, source_dict)
+    open_transaction_store.cache_clear()
 
-    count = 0
-    header_text = ""
-    for line in file_lines:
-        # Don't parse first line
-        if count == 0:
-            header_text = line
-            count += 1
-            continue
 
-        # Extract date and make date formats match
-        date_str = get_column_value(args.date_column, line, header_text)
-        date_key = get_date_key(args, date_str)
+def get_transactions_source(args, file_size):
+    # Describes the transactions file that a store or index was built from
+    return {
+        "File": os.path.abspath(args.transactions_file),
+        "Size": file_size,
+        "Modified Time": os.stat(args.transactions_file).st_mtime_ns,
+        "Encoding": locale.getpreferredencoding(False),
+    }
 
-        # Extract amount
-        amount_str = get_column_value(args.amount_column, line, header_text)
-        match = re.search(r"\d+(\.\d+)?", amount_str)
-        if match:
-            amount_flt = float(match.group(0))
-        else:
-            amount_flt = 0
 
-        match = re.findall(args.search_pattern, line)
-        if match and is_date_in_valid_range(args, date_str):
-            # Save to category_dict
-            add_transaction_json(args, category_dict, args.search_pattern, date_key, amount_flt, line)
-        count += 1
+def is_transactions_source_unchanged(args, header_dict, source_dict):
+    if header_dict.get("Source") == source_dict:
+        return True
 
-    # Write date to files
-    save_transaction_json(args, category_dict)
-    save_transaction_csv(args, category_dict)
+    # A copied or touched file only has a new modified time, the contents are checked before rebuilding
+    saved_source_dict = dict(header_dict.get("Source", {}), **{"Modified Time": source_dict["Modified Time"]})
+    return saved_source_dict == source_dict and \
+        header_dict.get("Source Hash") == get_file_hash(args.transactions_file, source_dict["Size"])
+
+
+def build_transaction_store(args, source_dict):
+    # Every column is interned, each row keeps one id per column into the distinct values of that column
+    encoding = locale.getpreferredencoding(False)
+    with open(args.transactions_file, 'rb') as file_in_transactions:
+        header_index = get_header_index(decode_line(file_in_transactions.readline(), encoding))
+
+    offset_array = array.array('q')
+    value_count_array = array.array('i')
+    line_end_array = array.array('q')
+    line_list = []
+    line_end = 0
+    column_id_dict_list = []
+    column_id_array_list = []
+    for row_index, row in enumerate(read_transaction_file(args, None, source_dict["Size"])):
+        offset_array.append(row.offset)
+        value_count_array.append(len(row.values))
+        line = row.line.encode("utf-8")
+        line_list.append(line)
+        line_end += len(line)
+        line_end_array.append(line_end)
+
+        # Columns first seen on this row are left at id 0 for the earlier rows, the value count keeps them from being
+        # read
+        while len(column_id_array_list) < len(row.values):
+            column_id_dict_list.append({})
+            column_id_array_list.append(array.array('i', [0]) * row_index)
+        for column_index, column_id_array in enumerate(column_id_array_list):
+            if column_index < len(row.values):
+                column_id_dict = column_id_dict_list[column_index]
+                column_id_array.append(column_id_dict.setdefault(row.values[column_index], len(column_id_dict)))
+            else:
+                column_id_array.append(0)
+
+    section_list = [
+        ("Offsets", offset_array),
+        ("Value Counts", value_count_array),
+        ("Line Ends", line_end_array),
+        ("Lines", b"".join(line_list)),
+        ("Column Values", json.dumps([list(column_id_dict.keys()) for column_id_dict in column_id_dict_list],
+                                     ensure_ascii=False).encode("utf-8")),
+    ] + [
+        ("Column Ids {}".format(column_index), column_id_array)
+        for column_index, column_id_array in enumerate(column_id_array_list)
+    ]
+    header_dict = {
+        "Source": source_dict,
+        "Source Hash": get_file_hash(args.transactions_file, source_dict["Size"]),
+        "Header Index": header_index,
+        "Row Count": len(offset_array),
+        "Column Count": len(column_id_array_list),
+        "Min Value Count": min(value_count_array, default=0),
+    }
+    write_section_file(args.transactions_store_file, transaction_store_magic, header_dict, section_list)
+
+
+def write_section_file(output_file, magic, header_dict, section_list):
+    # A json header followed by binary sections.  Sections start on 8 byte boundaries so arrays can be read straight
+    # out of a memory map.
+    section_dict = {}
+    section_start = 0
+    for name, section in section_list:
+        section_length = memoryview(section).nbytes
+        section_dict[name] = [section_start, section_length, getattr(section, "typecode", None)]
+        section_start += -(-section_length // 8) * 8
+    header = json.dumps(dict(header_dict, Sections=section_dict), ensure_ascii=False).encode("utf-8")
+
+    # Write to a temporary file first so an interrupted run doesn't leave a broken file behind
+    temp_output_file = "{}.tmp".format(output_file)
+    with open(temp_output_file, 'wb') as file_out:
+        file_out.write(magic)
+        file_out.write(len(header).to_bytes(8, "little"))
+        file_out.write(header)
+        file_out.write(bytes(-file_out.tell() % 8))
+        for name, section in section_list:
+            file_out.write(section)
+            file_out.write(bytes(-memoryview(section).nbytes % 8))
+    os.replace(temp_output_file, output_file)
+
+
+def read_section_file_header(section_file, magic):
+    # Returns the header of a file written by write_section_file() and where its sections start
+    with open(section_file, 'rb') as file_in:
+        if file_in.read(len(magic)) != magic:
+            raise ValueError("{} was not written by this version of Mint_Parser.py.".format(section_file))
+        header_length = int.from_bytes(file_in.read(8), "little")
+        header_dict = json.loads(file_in.read(header_length).decode("utf-8"))
+        data_offset = file_in.tell() + -file_in.tell() % 8
+    return header_dict, data_offset
+
+
+def open_section_file(section_file, magic):
+    # Memory maps a file written by write_section_file(), arrays are read from the file as they are used
+    header_dict, data_offset = read_section_file_header(section_file, magic)
+    with open(section_file, 'rb') as file_in:
+        file_view = memoryview(mmap.mmap(file_in.fileno(), 0, access=mmap.ACCESS_READ))
+
+    section_dict = {}
+    for name, (section_start, section_length, typecode) in header_dict["Sections"].items():
+        section = file_view[data_offset + section_start:data_offset + section_start + section_length]
+        section_dict[name] = section.cast(typecode) if typecode else section
+    return header_dict, section_dict
+
+
+@functools.lru_cache(maxsize=None)
+def open_transaction_store(store_file):
+    return TransactionStore(store_file)
+
+
+class TransactionStore:
+    # The transaction store memory mapped, the arrays are read from the file as they are used
+    __slots__ = ("header_index", "row_count", "min_value_count", "offsets", "value_counts", "line_ends", "lines",
+                 "column_values", "column_ids")
+
+    def __init__(self, store_file):
+        header_dict, section_dict = open_section_file(store_file, transaction_store_magic)
+        self.header_index = header_dict["Header Index"]
+        self.row_count = header_dict["Row Count"]
+        self.min_value_count = header_dict["Min Value Count"]
+        self.offsets = section_dict["Offsets"]
+        self.value_counts = section_dict["Value Counts"]
+        self.line_ends = section_dict["Line Ends"]
+        self.lines = section_dict["Lines"]
+        self.column_values = json.loads(str(section_dict["Column Values"], "utf-8"))
+        self.column_ids = [
+            section_dict["Column Ids {}".format(column_index)] for column_index in range(header_dict["Column Count"])
+        ]
 
+    def map_column(self, column, function):
+        # Calls the function once for each distinct value of the column.  The result for rows that don't have the
+        # column is last, which is where StoredTransactionRow.get_id() points them.
+        column_index = self.header_index.get(column)
+        value_list = []
+        if column_index is not None and column_index < len(self.column_values):
+            value_list = [function(value) for value in self.column_values[column_index]]
+        if self.row_count > 0 and (column_index is None or column_index >= self.min_value_count):
+            value_list.append(function(""))
+        return value_list
+
+
+def get_stored_dates_and_amounts(args, store):
+    # Date keys, whether each date is in the date range and amounts for every distinct value in the store, these are
+    # indexed by StoredTransactionRow.get_id()
+    date_key_list = store.map_column(args.date_column, lambda date_str: get_date_key(args, date_str))
+    date_in_range_list = store.map_column(args.date_column, lambda date_str: is_date_in_valid_range(args, date_str))
+    amount_list = store.map_column(args.amount_column, lambda amount_str: get_amount(amount_str, args.amount_cents))
+    return date_key_list, date_in_range_list, amount_list
+
+
+def read_stored_transactions(store, start_offset=None, end_offset=None):
+    # Rows are found by their offset in the transactions file, so byte ranges work the same as reading the file
+    start_index = 0 if start_offset is None else bisect.bisect_left(store.offsets, start_offset)
+    end_index = store.row_count if end_offset is None else bisect.bisect_left(store.offsets, end_offset)
+    for index in range(start_index, end_index):
+        yield StoredTransactionRow(store, index)
+
+
+def read_stored_transactions_at(store, offset_list):
+    for offset in offset_list:
+        yield StoredTransactionRow(store, bisect.bisect_left(store.offsets, offset))
+
+
+def load_date_index(args, file_size):
+    # Builds the date index if it is missing or no longer matches the transactions file and date column
+    source_dict = get_transactions_source(args, file_size)
+    header_dict = None
+    if os.path.exists(args.date_index_file):
+        try:
+            header_dict = read_section_file_header(args.date_index_file, date_index_magic)[0]
+        except ValueError as err:
+            print("Date index {} is not valid, rebuilding it.\n{}".format(args.date_index_file, err))
 
-def add_transaction_json(args, category_dict, key, date_key, amount_flt, line):
-    temp_category_dict = {
-        "Total": 0,
-        "Transactions": [],
-        args.date_period: {},
-        "Transaction Count": 0
-    }
+    if header_dict is not None and header_dict.get("Date Column") == args.date_column and \
+            header_dict.get("Date Format") == args.date_format and \
+            is_transactions_source_unchanged(args, header_dict, source_dict):
+        return
 
-    if key not in category_dict.keys():
-        category_dict[key] = copy.deepcopy(temp_category_dict)
+    print("Building date index {} from {}".format(args.date_index_file, args.transactions_file))
+    build_date_index(args, source_dict)
+    open_date_index.cache_clear()
 
-    if date_key not in category_dict[key][args.date_period]:
-        category_dict[key][args.date_period][date_key] = amount_flt
+
+def build_date_index(args, source_dict):
+    # The day of every row sorted with the offset of the row, rows on the same day stay in file order
+    if args.transactions_store_file:
+        row_iterator = read_stored_transactions(open_transaction_store(args.transactions_store_file), None,
+                                                source_dict["Size"])
     else:
-        category_dict[key][args.date_period][date_key] += amount_flt
+        row_iterator = read_transaction_file(args, None, source_dict["Size"])
+    ordinal_list = []
+    offset_list = []
+    for row in row_iterator:
+        ordinal_list.append(parse_date(row.get(args.date_column), args.date_format).toordinal())
+        offset_list.append(row.offset)
+    sorted_index_list = sorted(range(len(ordinal_list)), key=ordinal_list.__getitem__)
+
+    section_list = [
+        ("Ordinals", array.array('q', [ordinal_list[index] for index in sorted_index_list])),
+        ("Offsets", array.array('q', [offset_list[index] for index in sorted_index_list])),
+    ]
+    header_dict = {
+        "Source": source_dict,
+        "Source Hash": get_file_hash(args.transactions_file, source_dict["Size"]),
+        "Date Column": args.date_column,
+        "Date Format": args.date_format,
+    }
+    write_section_file(args.date_index_file, date_index_magic, header_dict, section_list)
 
-    category_dict[key]["Transactions"].append(line)
-    category_dict[key]["Total"] += amount_flt
-    category_dict[key]["Transaction Count"] = len(category_dict[key]["Transactions"])
-    category_dict[key]["{} Average".format(args.date_period)] = round(category_dict[key]["Total"]/len(category_dict[key][args.date_period]), 2)
-    category_dict[key]["{} Count".format(args.date_period)] = len(category_dict[key][args.date_period])
 
+@functools.lru_cache(maxsize=None)
+def open_date_index(index_file):
+    return open_section_file(index_file, date_index_magic)[1]
 
-def save_transaction_json(args, category_dict):
-    # Write dictionary to json file
-    with open(args.output_file_json, 'w') as file_out:
-        json.dump(category_dict, file_out, sort_keys=True, indent=4, ensure_ascii=False)
+
+def get_date_index_offsets(args, start_offset=None, end_offset=None):
+    # Offsets of the rows dated inside of the date range, in file order.  Rows are picked by day so dates with a time
+    # are still checked against the date range as they are grouped.
+    section_dict = open_date_index(args.date_index_file)
+    ordinals = section_dict["Ordinals"]
+    start_index = 0
+    end_index = len(ordinals)
+    if args.start_date:
+        start_index = bisect.bisect_left(ordinals, parse_date(args.start_date, args.date_format).toordinal())
+    if args.end_date:
+        end_index = bisect.bisect_right(ordinals, parse_date(args.end_date, args.date_format).toordinal())
+    return sorted(
+        offset for offset in section_dict["Offsets"][start_index:end_index]
+        if (start_offset is None or offset >= start_offset) and (end_offset is None or offset < end_offset)
+    )
 
 
-def save_transaction_csv(args, category_dict):
-    with open(args.output_file_csv, 'w', newline='') as file_out:
-        # Writing header
-        fieldnames = [
-            'Key', "{} Date".format(args.date_period), "Total",
-            "{} Total".format(args.date_period), "{} Average".format(args.date_period),
-            "{} Count".format(args.date_period), "Transaction Count"
+class StoredTransactionRow:
+    # A transaction read from the transaction store, the line is only decoded when it is used
+    __slots__ = ("store", "index", "header_index", "offset")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+        self.header_index = store.header_index
+        self.offset = store.offsets[index]
+
+    @property
+    def line(self):
+        line_start = self.store.line_ends[self.index - 1] if self.index > 0 else 0
+        return str(self.store.lines[line_start:self.store.line_ends[self.index]], "utf-8")
+
+    @property
+    def values(self):
+        store, index = self.store, self.index
+        return [
+            store.column_values[column_index][store.column_ids[column_index][index]]
+            for column_index in range(store.value_counts[index])
         ]
-        writer = csv.DictWriter(file_out, fieldnames=fieldnames)
-        writer.writeheader()
-
-        for key1, value1 in sorted(category_dict.items()):
-            count = 0
-            for key2, value2 in value1[args.date_period].items():
-                if count == 0:
-                    writer.writerow({
-                        "Key": key1,
-                        "Total": value1["Total"],
-                        "{} Date".format(args.date_period): key2,
-                        "{} Total".format(args.date_period): value2,
-                        "{} Average".format(args.date_period): round(value1["Total"]/len(value1[args.date_period]), 2),
-                        "{} Count".format(args.date_period): len(value1[args.date_period]),
-                        "Transaction Count": len(value1["Transactions"])
-                    })
-                else:
-                    writer.writerow({
-                        "{} Date".format(args.date_period): key2,
-                        "{} Total".format(args.date_period): value2
-                    })
-                count += 1
-            # Skip a line
-            writer.writerow({"Key": ""})
-
-
-def get_column_value(column, line, header_line):
-    # Split the header
-    header_line_split = header_line.split("\",\"")
-    header_line_split[0] = header_line_split[0].lstrip('"')
-    header_line_split[-1] = header_line_split[-1].rstrip('"\n')
-
-    # Split the columns
-    line_split = line.split("\",\"")
-    line_split[0] = line_split[0].lstrip('"')
-    line_split[-1] = line_split[-1].lstrip('"\n')
 
-    for key, value in zip(header_line_split, line_split):
-        if key == column:
-            return value
-    return ""
+    def get(self, column):
+        column_index = self.header_index.get(column)
+        if column_index is None or column_index >= self.store.value_counts[self.index]:
+            return ""
+        return self.store.column_values[column_index][self.store.column_ids[column_index][self.index]]
+
+    def get_id(self, column):
+        # Id of the value in the column, or -1 if the row doesn't have the column
+        column_index = self.header_index.get(column)
+        if column_index is None or column_index >= self.store.value_counts[self.index]:
+            return -1
+        return self.store.column_ids[column_index][self.index]
+
+    def get_text(self, skip_column_list):
+        # All the column values except the skipped ones joined together
+        skip_index_set = {self.header_index.get(column) for column in skip_column_list}
+        return "\x1f".join(value for index, value in enumerate(self.values) if index not in skip_index_set)
+
+
+def add_transaction_json(args, category_dict, key, date_key, amount_flt, transaction):
+    category_accumulator = category_dict.get(key)
+    if category_accumulator is None:
+        category_accumulator = category_dict[key] = CategoryAccumulator(len(date_key))
+    category_accumulator.add(date_key, amount_flt, transaction)
+
+
+class CategoryAccumulator:
+    # Running totals for one key of category_dict.  There is a dict of period totals for each --date_period, and a date
+    # key holds one key for each of them.  Fields derived from them like the period average and count are only built
+    # when the results are written.  Transactions are only kept if they are not None, see --transaction_retention.
+    __slots__ = ("total", "period_totals_list", "transactions", "transaction_count")
+
+    def __init__(self, period_count=1):
+        self.total = 0
+        self.period_totals_list = [{} for i in range(period_count)]
+        self.transactions = []
+        self.transaction_count = 0
+
+    def add(self, date_key, amount_flt, transaction):
+        for period_key, period_totals in zip(date_key, self.period_totals_list):
+            if period_key in period_totals:
+                period_totals[period_key] += amount_flt
+            else:
+                period_totals[period_key] = amount_flt
+        self.total += amount_flt
+        if transaction is not None:
+            self.transactions.append(transaction)
+        self.transaction_count += 1
+
+    def merge(self, other):
+        # Add the results of a later chunk of the transactions file
+        for period_totals, other_period_totals in zip(self.period_totals_list, other.period_totals_list):
+            for period_key, amount_flt in other_period_totals.items():
+                if period_key in period_totals:
+                    period_totals[period_key] += amount_flt
+                else:
+                    period_totals[period_key] = amount_flt
+        self.total += other.total
+        self.transactions.extend(other.transactions)
+        self.transaction_count += other.transaction_count
+
+    def to_state(self):
+        # Everything needed to rebuild the accumulator from a checkpoint
+        return [self.total, self.period_totals_list, self.transactions, self.transaction_count]
+
+    @classmethod
+    def from_state(cls, state):
+        category_accumulator = cls()
+        category_accumulator.total, category_accumulator.period_totals_list, category_accumulator.transactions, \
+            category_accumulator.transaction_count = state
+        return category_accumulator
+
+    def from_cents(self):
+        # Copy with the totals added up by --amount_cents turned back into dollars
+        category_accumulator = CategoryAccumulator(0)
+        category_accumulator.total = self.total / 100
+        category_accumulator.period_totals_list = [
+            {period_key: period_total / 100 for period_key, period_total in period_totals.items()}
+            for period_totals in self.period_totals_list
+        ]
+        category_accumulator.transactions = self.transactions
+        category_accumulator.transaction_count = self.transaction_count
+        return category_accumulator
+
+    def get_period_average(self, period_index=0):
+        return round(self.total/len(self.period_totals_list[period_index]), 2)
+
+    def to_dict(self, date_period_list, include_transactions=True):
+        category_dict = {
+            "Total": self.total,
+            "Transaction Count": self.transaction_count,
+        }
+        for period_index, date_period in enumerate(date_period_list):
+            period_totals = self.period_totals_list[period_index]
+            category_dict[date_period] = period_totals
+            category_dict["{} Average".format(date_period)] = self.get_period_average(period_index)
+            category_dict["{} Count".format(date_period)] = len(period_totals)
+        if include_transactions:
+            category_dict["Transactions"] = self.transactions
+        return category_dict
+
+
+def merge_category_dict(args, category_dict, partial_category_dict):
+    # Merge the results of a later chunk of the transactions file into category_dict
+    for key, value in partial_category_dict.items():
+        if key not in category_dict:
+            category_dict[key] = value
+        else:
+            category_dict[key].merge(value)
+
+
+def save_transaction_json(args, category_dict, output_file_json):
+    with open(output_file_json, 'w', buffering=write_buffer_size) as file_out:
+        write_transaction_json(args, category_dict, file_out)
+
+
+def write_transaction_json(args, category_dict, file_out):
+    # Write one category at a time so the whole result is never built in memory
+    include_transactions = args.transaction_retention != "None"
+    if args.amount_cents:
+        category_dict = {key: value.from_cents() for key, value in category_dict.items()}
+    if args.output_json_style == "Lines":
+        # One json object per line, with the key first
+        for key in sorted(category_dict):
+            value_json = json.dumps(category_dict[key].to_dict(args.date_period, include_transactions),
+                                    sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+            file_out.write('{{"Key":{},{}\n'.format(json.dumps(key, ensure_ascii=False), value_json[1:]))
+
+    elif args.output_json_style == "Compact":
+        file_out.write("{")
+        for index, key in enumerate(sorted(category_dict)):
+            if index > 0:
+                file_out.write(",")
+            file_out.write(json.dumps(key, ensure_ascii=False))
+            file_out.write(":")
+            file_out.write(json.dumps(category_dict[key].to_dict(args.date_period, include_transactions),
+                                      sort_keys=True, ensure_ascii=False, separators=(",", ":")))
+        file_out.write("}")
+
+    # Same as json.dump() with indent=4, each category is nested one level deeper
+    elif not category_dict:
+        file_out.write("{}")
+    else:
+        encoder = json.JSONEncoder(sort_keys=True, indent=4, ensure_ascii=False)
+        file_out.write("{")
+        for index, key in enumerate(sorted(category_dict)):
+            file_out.write(",\n    " if index > 0 else "\n    ")
+            file_out.write(json.dumps(key, ensure_ascii=False))
+            file_out.write(": ")
+            for chunk in encoder.iterencode(category_dict[key].to_dict(args.date_period, include_transactions)):
+                file_out.write(chunk.replace("\n", "\n    "))
+        file_out.write("\n}")
+
+
+def save_transaction_csv(args, category_dict, output_file_csv):
+    # One csv file for each --date_period
+    for period_index, period_output_file_csv in enumerate(get_period_output_files(args, output_file_csv)):
+        with open(period_output_file_csv, 'w', newline='', buffering=write_buffer_size) as file_out:
+            write_transaction_csv(args, category_dict, file_out, period_index)
+
+
+def get_period_output_files(args, output_file_csv):
+    # If this a multiple date period run, the date period is added to the output file so that we don't overwrite results
+    if len(args.date_period) > 1:
+        split_file_csv = os.path.splitext(output_file_csv)
+        return ["{}-{}{}".format(split_file_csv[0], date_period, split_file_csv[1]) for date_period in args.date_period]
+    return [output_file_csv]
+
+
+def write_transaction_csv(args, category_dict, file_out, period_index=0):
+    # Writing header, the field names are only built once
+    date_period = args.date_period[period_index]
+    fieldnames = [
+        'Key', "{} Date".format(date_period), "Total",
+        "{} Total".format(date_period), "{} Average".format(date_period),
+        "{} Count".format(date_period), "Transaction Count"
+    ]
+    empty_row = [""] * len(fieldnames)
+    if args.amount_cents:
+        category_dict = {key: value.from_cents() for key, value in category_dict.items()}
+    writer = csv.writer(file_out)
+    writer.writerow(fieldnames)
+
+    for key in sorted(category_dict):
+        value = category_dict[key]
+        period_totals = value.period_totals_list[period_index]
+        count = 0
+        for period_key, period_total in period_totals.items():
+            if count == 0:
+                writer.writerow([
+                    key, period_key, value.total, period_total, value.get_period_average(period_index),
+                    len(period_totals), value.transaction_count
+                ])
+            else:
+                writer.writerow(["", period_key, "", period_total, "", "", ""])
+            count += 1
+        # Skip a line
+        writer.writerow(empty_row)
+
+
+class Profiler:
+    # Accumulates the time and number of calls of each stage.  Stages can call each other, the time of a stage doesn't
+    # include the time of the stages it calls.
+    __slots__ = ("stage_dict", "pattern_dict", "inner_time")
+
+    def __init__(self):
+        self.stage_dict = {}
+        self.pattern_dict = {}
+        self.inner_time = 0
+
+    def wrap(self, name, function):
+        stage = self.stage_dict.setdefault(name, [0, 0])
+
+        def profiled_function(*args):
+            inner_time = self.inner_time
+            start_time = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                elapsed_time = time.perf_counter() - start_time
+                stage[0] += elapsed_time - (self.inner_time - inner_time)
+                stage[1] += 1
+                self.inner_time = inner_time + elapsed_time
+        return profiled_function
+
+    def wrap_iterator(self, name, iterator):
+        next_function = self.wrap(name, functools.partial(next, iterator, None))
+        while True:
+            item = next_function()
+            if item is None:
+                return
+            yield item
+
+    def time_patterns(self, pattern_list, line):
+        # Search the line with every pattern on its own.  This isn't a stage, the time is left out of the stage that
+        # called it.
+        start_time = time.perf_counter()
+        for name, pattern in pattern_list:
+            pattern_start_time = time.perf_counter()
+            match = pattern.search(line)
+            elapsed_time = time.perf_counter() - pattern_start_time
+            pattern_stats = self.pattern_dict.setdefault(name, [0, 0, 0])
+            pattern_stats[0] += elapsed_time
+            pattern_stats[1] += 1
+            if match:
+                pattern_stats[2] += 1
+        self.inner_time += time.perf_counter() - start_time
+
+    def merge(self, other):
+        # Add the stages timed by a worker process
+        for name, (elapsed_time, calls) in other.stage_dict.items():
+            stage = self.stage_dict.setdefault(name, [0, 0])
+            stage[0] += elapsed_time
+            stage[1] += calls
+        for name, (elapsed_time, calls, matches) in other.pattern_dict.items():
+            pattern_stats = self.pattern_dict.setdefault(name, [0, 0, 0])
+            pattern_stats[0] += elapsed_time
+            pattern_stats[1] += calls
+            pattern_stats[2] += matches
+
+    def to_dict(self):
+        total_time = sum(elapsed_time for elapsed_time, calls in self.stage_dict.values())
+        return {
+            "Stages": {
+                name: {
+                    "Time": round(elapsed_time, 6),
+                    "Calls": calls,
+                    "Percent": round(elapsed_time/total_time*100, 2) if total_time else 0,
+                }
+                for name, (elapsed_time, calls) in self.stage_dict.items()
+            },
+            "Patterns": {
+                name: {"Time": round(elapsed_time, 6), "Calls": calls, "Matches": matches}
+                for name, (elapsed_time, calls, matches) in sorted(
+                    self.pattern_dict.items(), key=lambda item: item[1][0], reverse=True)
+            },
+        }
+
+    def print_summary(self, pattern_count=10):
+        profile_dict = self.to_dict()
+        print("{:<40} {:>10} {:>12} {:>12} {:>8}".format("Stage", "Calls", "Time (s)", "Per Call (us)", "%"))
+        for name, stage in sorted(profile_dict["Stages"].items(), key=lambda item: item[1]["Time"], reverse=True):
+            print("{:<40} {:>10} {:>12.4f} {:>12.2f} {:>8.2f}".format(
+                name, stage["Calls"], stage["Time"], stage["Time"]/stage["Calls"]*1000000 if stage["Calls"] else 0,
+                stage["Percent"]))
+
+        if profile_dict["Patterns"]:
+            print("")
+            print("{:<60} {:>10} {:>10} {:>12}".format("Slowest Patterns", "Calls", "Matches", "Time (s)"))
+            for name, pattern_stats in list(profile_dict["Patterns"].items())[:pattern_count]:
+                print("{:<60} {:>10} {:>10} {:>12.4f}".format(
+                    name[:60], pattern_stats["Calls"], pattern_stats["Matches"], pattern_stats["Time"]))
+
+    def save(self, output_file):
+        with open(output_file, 'w') as file_out:
+            json.dump(self.to_dict(), file_out, indent=4, ensure_ascii=False)
+
+
+@functools.lru_cache(maxsize=date_cache_size)
+def parse_date(date_str, date_format):
+    # Exports only contain a few thousand distinct dates, so each one is only parsed once per run
+    if date_format == date_import_format:
+        # Fast path for the default format that avoids strptime
+        date_split = date_str.split("/")
+        if len(date_split) == 3:
+            month_str, day_str, year_str = date_split
+            digits = month_str + day_str + year_str
+            if 0 < len(month_str) < 3 and 0 < len(day_str) < 3 and len(year_str) == 4 and \
+                    digits.isascii() and digits.isdigit():
+                return datetime(int(year_str), int(month_str), int(day_str))
+    return datetime.strptime(date_str, date_format)
 
 
 def is_date_in_valid_range(args, date_str):
-    date_obj = datetime.strptime(date_str, args.date_format)
+    date_obj = parse_date(date_str, args.date_format)
 
     if args.start_date:
         # Check if date is before start date
-        start_date_obj = datetime.strptime(args.start_date, args.date_format)
+        start_date_obj = parse_date(args.start_date, args.date_format)
         if date_obj < start_date_obj:
             return False
 
     if args.end_date:
         # Check if date is after end date
-        end_date_obj = datetime.strptime(args.end_date, args.date_format)
+        end_date_obj = parse_date(args.end_date, args.date_format)
         if date_obj > end_date_obj:
             return False
 
@@ -628,55 +2735,105 @@ def is_date_in_valid_range(args, date_str):
 
 
 def get_date_key(args, date_str):
-    # Set date-key to date_str just in case no if condition pass
-    date_key = date_str
+    # The key of every --date_period
+    return get_period_keys(date_str, args.date_period, args.date_format, args.fiscal_year_start_month)
 
-    # Don't group by date, just convert to common format
-    if args.date_period == "Real":
-        date_key = date_str
-    else:
-        date_obj = datetime.strptime(date_str, args.date_format)
-
-        # Nothing need to be done here
-        if args.date_period == "Daily":
-            date_key = date_obj.strftime("%Y-%m-%d")
-
-        # Return back the date range of 1 week
-        elif args.date_period == "Weekly":
-            # 1st week
-            if date_obj.day < 8:
-                date_key = date_obj.strftime("%Y-%m-01 to %Y-%m-07")
-            # 2nd week
-            elif date_obj.day < 15:
-                date_key = date_obj.strftime("%Y-%m-08 to %Y-%m-14")
-            # 3rd week
-            elif date_obj.day < 22:
-                date_key = date_obj.strftime("%Y-%m-15 to %Y-%m-21")
-            # 4th week
-            else:
-                last_day = calendar.monthrange(date_obj.year, date_obj.month)[1]
-                date_key = date_obj.strftime("%Y-%m-22 to %Y-%m-{}".format(last_day))
-
-        # Return back the date range of 2 weeks
-        elif args.date_period == "Biweekly":
-            # Weeks 1 and 2
-            if date_obj.day < 15:
-                date_key = date_obj.strftime("%Y-%m-01 to %Y-%m-14")
-            # Weeks 3 and 4
-            else:
-                last_day = calendar.monthrange(date_obj.year, date_obj.month)[1]
-                date_key = date_obj.strftime("%Y-%m-15 to %Y-%m-{}".format(last_day))
 
-        # Need to set date_obj to current month
-        elif args.date_period == "Monthly":
-            date_key = date_obj.strftime("%Y-%m")
+@functools.lru_cache(maxsize=date_cache_size)
+def get_period_keys(date_str, date_period_tuple, date_format, fiscal_year_start_month=1):
+    # The date is parsed once for all of the date periods
+    date_obj = None
+    if date_period_tuple != ("Real",):
+        date_obj = parse_date(date_str, date_format)
+
+    # Don't group by date for Real, just use the date from the transactions file
+    return tuple(
+        date_str if date_period == "Real" else get_period_key_table(date_period, fiscal_year_start_month).get(date_obj)
+        for date_period in date_period_tuple
+    )
 
-        # Need to set date_obj to current year
-        elif args.date_period == "Yearly":
-            date_key = date_obj.strftime("%Y")
 
-    # Return date key
-    return date_key
+@functools.lru_cache(maxsize=None)
+def get_period_key_table(date_period, fiscal_year_start_month=1):
+    return PeriodKeyTable(date_period, fiscal_year_start_month)
+
+
+class PeriodKeyTable:
+    # Maps the ordinal of a date to its period key.  The first time a day of a period shows up the key is built and
+    # stored for every day of the period, so the other days of the period are only a dict lookup.
+    __slots__ = ("date_period", "fiscal_year_start_month", "key_dict")
+
+    def __init__(self, date_period, fiscal_year_start_month=1):
+        self.date_period = date_period
+        self.fiscal_year_start_month = fiscal_year_start_month
+        self.key_dict = {}
+
+    def get(self, date_obj):
+        ordinal = date_obj.toordinal()
+        key = self.key_dict.get(ordinal)
+        if key is None:
+            first_date_obj, last_date_obj, key = get_period_bucket(date_obj, self.date_period,
+                                                                   self.fiscal_year_start_month)
+            for period_ordinal in range(first_date_obj.toordinal(), last_date_obj.toordinal() + 1):
+                self.key_dict[period_ordinal] = key
+        return key
+
+
+def get_period_bucket(date_obj, date_period, fiscal_year_start_month=1):
+    # Returns the first day, last day and key of the period the date is in
+    # Nothing need to be done here
+    if date_period == "Daily":
+        return date_obj, date_obj, date_obj.strftime("%Y-%m-%d")
+
+    # Return back the date range of 1 week, the 4th week runs to the end of the month
+    elif date_period == "Weekly":
+        first_day = min((date_obj.day - 1) // 7, 3) * 7 + 1
+        last_day = first_day + 6 if first_day < 22 else calendar.monthrange(date_obj.year, date_obj.month)[1]
+        return get_period_range(date_obj.replace(day=first_day), date_obj.replace(day=last_day))
+
+    # Return back the date range of 2 weeks, weeks 3 and 4 run to the end of the month
+    elif date_period == "Biweekly":
+        first_day = 1 if date_obj.day < 15 else 15
+        last_day = 14 if date_obj.day < 15 else calendar.monthrange(date_obj.year, date_obj.month)[1]
+        return get_period_range(date_obj.replace(day=first_day), date_obj.replace(day=last_day))
+
+    # ISO 8601 weeks start on Monday, the first week of the year is the one with the first Thursday in it
+    elif date_period == "ISOWeekly":
+        first_date_obj = datetime.fromordinal(date_obj.toordinal() - date_obj.weekday())
+        iso_year, iso_week = date_obj.isocalendar()[:2]
+        return first_date_obj, datetime.fromordinal(first_date_obj.toordinal() + 6), \
+            "{}-W{:02d}".format(iso_year, iso_week)
+
+    # Need to set date_obj to current month
+    elif date_period == "Monthly":
+        last_day = calendar.monthrange(date_obj.year, date_obj.month)[1]
+        return date_obj.replace(day=1), date_obj.replace(day=last_day), date_obj.strftime("%Y-%m")
+
+    # Need to set date_obj to current year
+    elif date_period == "Yearly":
+        return date_obj.replace(month=1, day=1), date_obj.replace(month=12, day=31), date_obj.strftime("%Y")
+
+    # Fiscal years start on the first day of --fiscal_year_start_month and are named after the year they end in
+    elif date_period in ["FiscalQuarterly", "FiscalYearly"]:
+        period_months = 3 if date_period == "FiscalQuarterly" else 12
+        month_offset = (date_obj.month - fiscal_year_start_month) % 12
+        fiscal_start_month_index = date_obj.year * 12 + date_obj.month - 1 - month_offset
+        first_month_index = fiscal_start_month_index + month_offset - month_offset % period_months
+        first_date_obj = datetime(first_month_index // 12, first_month_index % 12 + 1, 1)
+        last_month_index = first_month_index + period_months
+        last_date_obj = datetime.fromordinal(
+            datetime(last_month_index // 12, last_month_index % 12 + 1, 1).toordinal() - 1)
+        fiscal_year = (fiscal_start_month_index + 11) // 12
+        if date_period == "FiscalYearly":
+            return first_date_obj, last_date_obj, "FY{}".format(fiscal_year)
+        return first_date_obj, last_date_obj, "FY{}-Q{}".format(fiscal_year, month_offset // 3 + 1)
+
+    raise ValueError("Unknown date period {}".format(date_period))
+
+
+def get_period_range(first_date_obj, last_date_obj):
+    return first_date_obj, last_date_obj, "{} to {}".format(first_date_obj.strftime("%Y-%m-%d"),
+                                                            last_date_obj.strftime("%Y-%m-%d"))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,279 @@
+import argparse
+import json
+import time
+import sys
+import re
+import os
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import Mint_Parser
+
+# A group with a quantifier inside of it that is quantified again, like (a+)+ or (\w+\s?)*
+nested_quantifier_regex = re.compile(r"\((?:[^()\\]|\\.)*(?:[*+]|\{\d*,\d*\})(?:[^()\\]|\\.)*\)(?:[*+]|\{\d*,\d*\})")
+# Unbounded wildcards like .* or .+ that aren't escaped
+wildcard_regex = re.compile(r"(?<!\\)(?:\\\\)*\.[*+]")
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Used to find redundant, shadowed and slow patterns in a pattern file '
+                                                 'for Mint_Parser.py, and to write an optimized copy of it.')
+
+    parser.add_argument(
+        '--pattern_file',
+        default="category_patterns_default.json",
+        help='Pattern file to analyze. Default is category_patterns_default.json.'
+    )
+    parser.add_argument(
+        '--transactions_file',
+        help='Transactions file used as a sample to count how often each pattern matches and time it. Without a '
+             'sample only the patterns themselves are checked.'
+    )
+    parser.add_argument(
+        '--sample_rows',
+        type=int,
+        default=0,
+        help='Only use the first rows of the --transactions_file. Default is 0 which uses every row.'
+    )
+    parser.add_argument(
+        '--output_file_json',
+        default="pattern_report.json",
+        help='File to output the json report to. Default is pattern_report.json.'
+    )
+    parser.add_argument(
+        '--output_pattern_file',
+        help='File to write the optimized patterns to. Leading and trailing ".*" are removed and patterns that can '
+             'never decide a category are dropped.'
+    )
+    parser.add_argument(
+        '--reorder_categories',
+        action='store_true',
+        help='Order the categories of the --output_pattern_file by how many sample rows they matched. Categories that '
+             'matched the same sample row keep their order, so every sample row keeps its category.'
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if args.reorder_categories and not args.transactions_file:
+        print("Error: --reorder_categories needs a --transactions_file to count the matches of each category.")
+        exit(1)
+
+    # Same checks as Mint_Parser.py, any errors in the pattern file are reported the same way
+    category_dict_pattern = Mint_Parser.load_pattern_file_or_exit(args).category_dict_pattern
+    report_list = get_pattern_reports(category_dict_pattern)
+
+    line_list = None
+    category_hits_dict = None
+    category_order = list(category_dict_pattern.keys())
+    if args.transactions_file:
+        line_list = read_sample_lines(args.transactions_file, args.sample_rows)
+        category_hits_dict, overlap_set = count_pattern_hits(category_dict_pattern, report_list, line_list)
+        category_order = get_category_order(category_order, category_hits_dict, overlap_set)
+
+    optimized_dict_pattern = get_optimized_patterns(category_dict_pattern, report_list,
+                                                    category_order if args.reorder_categories else None)
+
+    results_dict = {
+        "Pattern File": args.pattern_file,
+        "Sample File": args.transactions_file,
+        "Sample Rows": len(line_list) if line_list is not None else None,
+        "Patterns": report_list,
+        "Category Hits": category_hits_dict,
+        "Suggested Category Order": category_order if line_list is not None else None,
+    }
+    if line_list is not None:
+        results_dict.update(compare_patterns(category_dict_pattern, optimized_dict_pattern, line_list))
+    print_report(results_dict)
+
+    with open(args.output_file_json, 'w') as file_out:
+        json.dump(results_dict, file_out, indent=4)
+    print("Output report to {}".format(args.output_file_json))
+
+    if args.output_pattern_file:
+        with open(args.output_pattern_file, 'w') as file_out:
+            json.dump(optimized_dict_pattern, file_out, indent=4)
+        print("Output optimized patterns to {}".format(args.output_pattern_file))
+
+
+def get_pattern_reports(category_dict_pattern):
+    # Issues that can be found from the patterns alone.  Literal patterns are checked against every earlier literal, a
+    # line holding the longer literal always holds the shorter one too.  Inside of one category the order doesn't
+    # matter, so the longer literal is redundant whichever one comes first.
+    report_list = []
+    earlier_list = []
+    for category, pattern_list in category_dict_pattern.items():
+        for pattern in pattern_list:
+            rewrite = Mint_Parser.strip_pattern_wildcards(pattern)
+            literal = Mint_Parser.get_pattern_literal(pattern)
+            issue_list = []
+
+            for earlier_report, earlier_category, earlier_rewrite, earlier_literal in earlier_list:
+                earlier_pattern = earlier_report["Pattern"]
+                if rewrite == earlier_rewrite:
+                    issue = "Duplicate of" if earlier_category == category else "Shadowed by"
+                elif literal and earlier_literal and earlier_literal in literal:
+                    issue = "Redundant with" if earlier_category == category else "Shadowed by"
+                else:
+                    continue
+                issue_list.append("{} {}: {}".format(issue, earlier_category, earlier_pattern))
+                break
+            if literal and not issue_list:
+                for earlier_report, earlier_category, earlier_rewrite, earlier_literal in earlier_list:
+                    if earlier_category == category and earlier_literal and earlier_literal != literal and \
+                            literal in earlier_literal and not is_pattern_removed(earlier_report):
+                        earlier_report["Issues"].append("Redundant with {}: {}".format(category, pattern))
+
+            if nested_quantifier_regex.search(rewrite):
+                issue_list.append("Nested quantifier can backtrack catastrophically")
+            elif len(wildcard_regex.findall(rewrite)) > 1:
+                issue_list.append("Several wildcards make the search backtrack")
+
+            report = {
+                "Category": category,
+                "Pattern": pattern,
+                "Rewrite": rewrite if rewrite != pattern else None,
+                "Literal": literal is not None,
+                "Issues": issue_list,
+            }
+            report_list.append(report)
+            earlier_list.append((report, category, rewrite, literal))
+    return report_list
+
+
+def is_pattern_removed(report):
+    # Patterns that can never decide a category are left out of the optimized patterns
+    return any(issue.startswith(("Duplicate of", "Redundant with", "Shadowed by")) for issue in report["Issues"])
+
+
+def read_sample_lines(transactions_file, sample_rows):
+    # Patterns are searched against the whole line, the same as Mint_Parser.py
+    if not os.path.exists(transactions_file):
+        print("Error: {} not found.".format(transactions_file))
+        exit(1)
+    args = Mint_Parser.get_default_args(transactions_file=transactions_file)
+    line_list = []
+    for row in Mint_Parser.read_transaction_file(args):
+        line_list.append(row.line)
+        if len(line_list) == sample_rows:
+            break
+    return line_list
+
+
+def count_pattern_hits(category_dict_pattern, report_list, line_list):
+    # Adds the hits, first matches and time of each pattern to its report.  Returns the number of rows each category was
+    # the first match of, and the (first, later) pairs of categories that matched the same row.
+    category_list = list(category_dict_pattern.keys())
+    category_index_dict = {category: index for index, category in enumerate(category_list)}
+    pattern_list = [
+        (category_index_dict[report["Category"]], re.compile(report["Pattern"])) for report in report_list
+    ]
+    hit_list = [0] * len(pattern_list)
+    first_match_list = [0] * len(pattern_list)
+    time_list = [0] * len(pattern_list)
+    category_hit_list = [0] * len(category_list)
+    overlap_set = set()
+
+    for line in line_list:
+        first_pattern_index = None
+        matched_category_set = set()
+        for pattern_index, (category_index, pattern) in enumerate(pattern_list):
+            start_time = time.perf_counter()
+            match = pattern.search(line)
+            time_list[pattern_index] += time.perf_counter() - start_time
+            if match:
+                hit_list[pattern_index] += 1
+                matched_category_set.add(category_index)
+                if first_pattern_index is None:
+                    first_pattern_index = pattern_index
+
+        # Patterns are in category order, so the first matching pattern decides the category
+        if first_pattern_index is not None:
+            first_match_list[first_pattern_index] += 1
+            first_category_index = pattern_list[first_pattern_index][0]
+            category_hit_list[first_category_index] += 1
+            for category_index in matched_category_set:
+                if category_index != first_category_index:
+                    overlap_set.add((first_category_index, category_index))
+
+    for report, hits, first_matches, elapsed_time in zip(report_list, hit_list, first_match_list, time_list):
+        report["Hits"] = hits
+        report["First Matches"] = first_matches
+        report["Time"] = round(elapsed_time, 6)
+        if hits == 0:
+            report["Issues"].append("Never matched the sample")
+        elif first_matches == 0:
+            report["Issues"].append("Every sample row it matched was already matched by an earlier pattern")
+
+    category_hits_dict = {category: hits for category, hits in zip(category_list, category_hit_list)}
+    return category_hits_dict, {(category_list[i], category_list[j]) for i, j in overlap_set}
+
+
+def get_category_order(category_order, category_hits_dict, overlap_set):
+    # Most matched categories first.  A category that was the first match of a row has to stay ahead of every other
+    # category that matched the same row, so the sample rows keep their categories.
+    remaining_list = list(category_order)
+    ordered_list = []
+    while remaining_list:
+        ready_list = [
+            category for category in remaining_list
+            if not any((earlier_category, category) in overlap_set for earlier_category in remaining_list)
+        ]
+        category = max(ready_list, key=lambda ready_category: category_hits_dict[ready_category])
+        ordered_list.append(category)
+        remaining_list.remove(category)
+    return ordered_list
+
+
+def get_optimized_patterns(category_dict_pattern, report_list, category_order=None):
+    # Patterns without their leading and trailing ".*", leaving out the ones that can never decide a category
+    optimized_dict_pattern = {category: [] for category in category_order or category_dict_pattern.keys()}
+    for report in report_list:
+        if is_pattern_removed(report):
+            continue
+        optimized_dict_pattern[report["Category"]].append(report["Rewrite"] or report["Pattern"])
+    return optimized_dict_pattern
+
+
+def compare_patterns(category_dict_pattern, optimized_dict_pattern, line_list):
+    # Categorize the sample with both pattern files the way Mint_Parser.py does, the optimized patterns should give
+    # every row the same category
+    time_list = []
+    key_list_list = []
+    for dict_pattern in [category_dict_pattern, optimized_dict_pattern]:
+        category_matcher = Mint_Parser.CategoryMatcher(dict_pattern)
+        start_time = time.perf_counter()
+        key_list_list.append([category_matcher.match(line) for line in line_list])
+        time_list.append(time.perf_counter() - start_time)
+    return {
+        "Match Time": round(time_list[0], 4),
+        "Optimized Match Time": round(time_list[1], 4),
+        "Optimized Changed Rows": sum(1 for key, optimized_key in zip(*key_list_list) if key != optimized_key),
+    }
+
+
+def print_report(results_dict):
+    for report in results_dict["Patterns"]:
+        if report["Issues"] or report["Rewrite"]:
+            print("{}: {}".format(report["Category"], report["Pattern"]))
+            if report["Rewrite"]:
+                print("    Rewrite as {}".format(report["Rewrite"]))
+            for issue in report["Issues"]:
+                print("    {}".format(issue))
+
+    if results_dict["Sample Rows"] is None:
+        return
+    print("")
+    print("{:<30} {:>10} {:>8}".format("Category", "Rows", "Percent"))
+    for category, hits in sorted(results_dict["Category Hits"].items(), key=lambda item: -item[1]):
+        print("{:<30} {:>10} {:>7.1f}%".format(category, hits, hits / max(results_dict["Sample Rows"], 1) * 100))
+    print("")
+    print("Suggested category order: {}".format(", ".join(results_dict["Suggested Category Order"])))
+    print("Matching {} rows took {:.3f}s, {:.3f}s with the optimized patterns which changed the category of {} "
+          "rows".format(results_dict["Sample Rows"], results_dict["Match Time"], results_dict["Optimized Match Time"],
+                        results_dict["Optimized Changed Rows"]))
+
+
+if __name__ == "__main__":
+    main()